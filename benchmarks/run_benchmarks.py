@@ -0,0 +1,213 @@
+import argparse, json, os, platform, resource, subprocess, sys, tempfile, threading, time, tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import grew
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT / "tool"))
+sys.path.append(str(ROOT / "scripts"))
+from corpora import load_corpora
+from contingency import build_contingency
+from pattern_filter import dominant_patterns
+from run_studies import expand_predictors
+from significance import ALPHA, fisher_patterns
+
+# ---------- Benchmarks ----------
+#
+# The cases of benchmarks.json are run on the SUD_French-GSD dev and test
+# files: studies of scripts/studies.json (taken by name) are run in this
+# process phase by phase (contingency counts, Fisher tests, dominant filter),
+# and extraction_tool.py is run as a command. Each study is run twice: a
+# timed pass (wall time, throughput and peak RSS of the process sampled by a
+# thread) and a second pass under tracemalloc for the peak of the Python heap
+# of each phase, tracing being too slow to be on while timing. Commands report
+# their wall time and the peak RSS of the process and of the processes it
+# waited for (wait4), plus the phases and counters of their --trace file
+# (timed inside the command: only the "command" phase includes the start-up
+# of the interpreter and the imports). The grew server is a separate process, its memory is
+# not counted in the phases. Results are written as JSON, and --compare prints
+# the ratio of the times of two results files (e.g. two branches).
+
+def rss_mb() -> Optional[float]:
+    "Resident memory of this process (Linux), None elsewhere"
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return None
+
+
+class RSSSampler(threading.Thread):
+    "Peak resident memory while the sampler runs"
+
+    def __init__(self, interval : float = 0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.peak = rss_mb()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            current = rss_mb()
+            if current is not None:
+                self.peak = max(self.peak, current)
+
+    def stop(self) -> Optional[float]:
+        self.stopped.set()
+        self.join()
+        current = rss_mb()
+        return None if current is None else max(self.peak, current)
+
+@contextmanager
+def timed(results : Dict, name : str):
+    "Wall time (s) and peak RSS (MB) of the block, in results[name]"
+    res = results.setdefault(name, {})
+    sampler = RSSSampler()
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        yield res
+    finally:
+        res["wall_s"] = time.perf_counter() - start
+        res["peak_rss_mb"] = sampler.stop()
+
+@contextmanager
+def traced(results : Dict, name : str):
+    "Peak of the Python heap (MB) allocated in the block, in results[name]"
+    res = results.setdefault(name, {})
+    tracemalloc.start()
+    try:
+        yield res
+    finally:
+        res["heap_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+
+def run_study(study : Dict, treebank_idx : int, treebank, phase = timed, phases : Optional[Dict] = None) -> Dict:
+    "Phases of run_studies.study_rows, without query cache (every run is cold), measured by phase"
+    phases = {} if phases is None else phases
+    with phase(phases, "contingency") as res:
+        P3 = expand_predictors(study["P3"], treebank, study.get("exclude", []))
+        M, n, counts = build_contingency(treebank_idx, treebank, study["P1"], study["P2"], P3, study.get("all", False), quote=False,
+                                         min_support=study.get("min_support", 1), max_length=study.get("max_length"),
+                                         alpha=ALPHA if study.get("significant", False) else None)
+        res["matches"] = M
+    with phase(phases, "fisher") as res:
+        patterns, stats = fisher_patterns(counts, n, M)
+        res["patterns"] = len(patterns)
+    if study.get("dominant", False):
+        with phase(phases, "dominant") as res:
+            rows = np.flatnonzero(stats["pvalue"] < ALPHA)
+            keep = dominant_patterns([patterns[i].split("; ") for i in rows], stats["log10_pvalue"][rows], stats["probability_ratio"][rows])
+            res["patterns"] = len(keep)
+    if phase is timed:
+        phases["contingency"]["matches_per_s"] = M / max(phases["contingency"]["wall_s"], 1e-9)
+        phases["fisher"]["patterns_per_s"] = len(patterns) / max(phases["fisher"]["wall_s"], 1e-9)
+    return phases
+
+def run_command(args : List[str]) -> Dict:
+    "Wall time and peak RSS (MB) of a command"
+    start = time.perf_counter()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    res = {"wall_s" : time.perf_counter() - start, "peak_rss_mb" : usage.ru_maxrss / 2**10, "returncode" : process.returncode}
+    if process.returncode != 0:
+        res["error"] = output.decode("utf-8", errors="replace")[-2000:]
+    return res
+
+def run_cli(treebank_path : Path, cli : List[str]) -> Tuple[Dict, Dict]:
+    "Phases of an extraction_tool.py run: the whole command and the phases of its --trace, with the counters of the trace"
+    fd, trace_path = tempfile.mkstemp(prefix="trace-", suffix=".json")
+    os.close(fd)
+    try:
+        phases = {"command" : run_command([sys.executable, str(ROOT / "tool" / "extraction_tool.py"), str(treebank_path), "--trace", trace_path] + cli)}
+        if phases["command"]["returncode"] != 0:
+            return phases, {}
+        trace = json.loads(Path(trace_path).read_text(encoding="utf-8"))
+    finally:
+        os.unlink(trace_path)
+    phases.update(trace["phases"])
+    return phases, trace["counters"]
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_path : Path, new_path : Path):
+    "Wall time of every phase of new / old"
+    old, new = (json.loads(p.read_text(encoding="utf-8")) for p in (old_path, new_path))
+    old_cases = {case["name"] : case for case in old["cases"]}
+    for case in new["cases"]:
+        before = old_cases.get(case["name"])
+        if before is None:
+            continue
+        for name, res in case["phases"].items():
+            if name in before["phases"] and before["phases"][name]["wall_s"] > 0:
+                ratio = res["wall_s"] / before["phases"][name]["wall_s"]
+                print(f"{case['name']:30} {name:12} {before['phases'][name]['wall_s']:9.3f}s -> {res['wall_s']:9.3f}s  x{ratio:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of the extraction tools on the SUD_French-GSD dev/test files')
+    parser.add_argument('--cases', type=Path, default=Path(__file__).resolve().parent / "benchmarks.json", help='json file of the benchmark cases')
+    parser.add_argument('--only', nargs='*', default=None, help='names of the cases to run')
+    parser.add_argument('--output', type=Path, default=None, help='json file of the results (default: printed)')
+    parser.add_argument('--compare', nargs=2, type=Path, default=None, metavar=('OLD', 'NEW'), help='compare two results files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    spec = json.loads(args.cases.read_text(encoding="utf-8"))
+    base = args.cases.resolve().parent
+    treebank_path = base / spec["treebank"]
+    studies = {s["name"] : s for corpus in json.loads((base / spec["studies"]).read_text(encoding="utf-8"))["corpora"] for s in corpus["studies"]}
+    cases = [case for case in spec["cases"] if args.only is None or case["name"] in args.only]
+
+    results = {
+        "commit" : git_commit(),
+        "python" : sys.version.split()[0],
+        "platform" : platform.platform(),
+        "cpus" : os.cpu_count(),
+        "treebank" : spec["treebank"],
+        "cases" : [],
+    }
+    load = {}
+    if any("study" in case for case in cases):
+        grew.init()
+        with timed(load, "load") as res:
+            files, treebank = load_corpora(str(treebank_path), cache_dir=None)
+            treebank_idx = grew.corpus(files)
+            res["sentences"] = len(treebank)
+            res["tokens"] = treebank.n_tokens
+        load["load"]["sentences_per_s"] = len(treebank) / max(load["load"]["wall_s"], 1e-9)
+        results["cases"].append({"name" : "load", "phases" : load})
+        print(f"load: {load['load']['wall_s']:.2f}s, {len(treebank)} sentences")
+
+    for case in cases:
+        res = {"name" : case["name"]}
+        if "study" in case:
+            phases = run_study(studies[case["study"]], treebank_idx, treebank)
+            # Heap peaks measured in a second pass, not timed
+            run_study(studies[case["study"]], treebank_idx, treebank, traced, phases)
+        else:
+            phases, res["counters"] = run_cli(treebank_path, case["cli"])
+        res["phases"] = phases
+        results["cases"].append(res)
+        print(f"{case['name']}: " + ", ".join(f"{name} {res['wall_s']:.2f}s" for name, res in phases.items()))
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+    results["children_peak_rss_mb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2**10
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        args.output.write_text(text + "\n", encoding="utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -1,66 +1,33 @@
-import subprocess
-import json
+import grew
 from pathlib import Path
-from collections import namedtuple, defaultdict
-from itertools import chain, combinations
+from collections import namedtuple
 import numpy as np
 from typing import Dict
-import csv
 import re
-from scipy.stats import fisher_exact
+import sys
 
-# ------------------ Fonctions ------------------
+sys.path.append(str(Path(__file__).resolve().parents[1] / "tool"))
+from grew_session import GrewSession
+from significance import ALPHA, fisher_batch, min_testable_support
+from pattern_mining import fp_growth
+from pattern_filter import dominant_patterns
 
-def conll_to_dict(path : str) -> dict:
-
-    p = "../treebanks/" + path
-    with open (p) as f:
-        conll = f.read().strip()
-        
-    trees = dict()
-    sentences = [x.split("\n") for x in conll.split("\n\n")]
-
-    for sent in sentences:
-        for line in sent:
-            if line.startswith("#"):
-                if "sent_id" in line:
-                    sent_id = line.split("=")[1].strip()
-                    trees[sent_id] = {}
-                    trees[sent_id]['0'] = ({"form" : "None"})
-            else:
-                token_id, form, lemma, upos, xpos, feats, head, deprel, deps, misc = line.split("\t")
-                if "-" not in token_id:
-                    trees[sent_id][token_id] = ({"form" : form, "lemma" : lemma, "upos" : upos, "deprel" : deprel})
-                    if feats != "_":
-                        features = [f.split("=") for f in feats.split("|")]
-                        dict_features = {lst[0]:lst[1] for lst in features}
-                        trees[sent_id][token_id].update(dict_features)
-    return trees
+# ------------------ Fonctions ------------------
 
 def concat_patterns(patterns : tuple) -> str:
     res = "; ".join(patterns)
     res = f"pattern {{ {res} }}"
     return res
 
-def powerset(iterable):
-    "powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
-    s = list(iterable)
-    return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
+# One grew session per corpora json, started on the first call and reused after
+# (all the sessions share the grew server started here)
+grew.init()
+sessions = {}
 
 def grew_count(*patterns , cluster : str, pattern_key : str, corpora) -> Dict[str, int]:
-    subprocess.check_output(f"grew compile -i ../treebanks/{corpora}.json".split(), stderr=subprocess.STDOUT)
-    with open("tmp.pat","w", encoding="utf-8") as file: 
-        file.write(concat_patterns(patterns))
-    command = ['grew', 'count', '-pattern', 'tmp.pat', f'-{cluster}', pattern_key, '-i', f'../treebanks/{corpora}.json']
-    res_process = subprocess.run(command, capture_output=True, encoding='utf-8').stdout
-
-    tmp_file = Path("tmp.pat").resolve()
-    Path.unlink(tmp_file)
-    
-    freq_pat = {}
-    for row in csv.DictReader(res_process.split("\n"), delimiter='\t'):
-        freq_pat = {k : int(v) for k, v in row.items() if k != 'Corpus'}
-    return freq_pat
+    if corpora not in sessions:
+        sessions[corpora] = GrewSession(f"../treebanks/{corpora}.json")
+    return sessions[corpora].grew_count(*patterns, cluster=cluster, key_pattern=pattern_key)
 
 # --------------------------------------------
 
@@ -70,24 +37,18 @@ corpora = "corpora-gsd"
 filename = 'accords_nom_nombre'
 pattern_M1 = 'X->Y; X[Number]; Y[Number]; X[upos=NOUN]'
 pattern_M2 = 'X.Number = Y.Number'
+# Seuils de la fouille : support minimal (N) et nombre maximal de prédicteurs par motif
+min_support = 1
+max_length = None
 
 
-# Parser le conllu
-corpus = conll_to_dict(treebank)
-
-# Récupérer toutes les phrases contenant le motif en utilisant Grew
-pattern = 'pattern {' + pattern_M1 + '}'
-with open("tmp.pat","w", encoding="utf-8") as f: 
-    f.write(pattern)
-    
-command = f"grew grep -pattern tmp.pat -i ../treebanks/{treebank}".split()
-match = subprocess.check_output(command, stderr=subprocess.STDOUT).decode("utf-8").strip()
-tmp_file = Path("tmp.pat").resolve()
-Path.unlink(tmp_file)
-
+# Session grew du conllu : les phrases contenant le motif sont cherchées dans le serveur grew,
+# et les traits des nœuds lus dans son treebank
+session = GrewSession(f"../treebanks/{treebank}")
+corpus = session.treebank
 
 # Récupérer tous les nœuds en question
-lst_match = json.loads(match)
+lst_match = session.search(pattern_M1)
 tpl_match = namedtuple('tpl_match', 'sent_id X Y')
 
 to_recover = []
@@ -98,7 +59,7 @@ for m in lst_match:
 
 
 # Création du dictionnaire avec les motifs et le nombre de accords et non-accords
-patterns = defaultdict(lambda: defaultdict(int))
+transactions = []
 
 for tpl in to_recover:
     lst = []
@@ -123,11 +84,7 @@ for tpl in to_recover:
         agreement = "disagree"
     nlst = [x for x in lst if "Number" not in x]
 
-    combs = powerset(nlst)
-
-    for c in combs:
-        if c:
-            patterns[c][agreement] += 1
+    transactions.append((nlst, 1 if agreement == "agree" else 0))
 
 
 freq_cond = grew_count(pattern_M1, cluster="whether", pattern_key=pattern_M2, corpora=corpora)
@@ -137,46 +94,27 @@ M = sum([v for v in freq_cond.values()])
 # Le nombre total d'accords
 n = freq_cond['Yes']
 
-# On calcule le test exact de Fisher pour chaque motif
-res = []
-for pat, value in patterns.items():
-    N = sum([v for v in value.values()])
-    k = value['agree']
-    table = np.array([[k, n-k], [N-k, M - (n + N) + k]])
-    oddsr, pvalue = fisher_exact(table=table, alternative='greater')
-    if pvalue < 0.01:
-        percent_M1M2 = (k/n)*100
-        percent_M1M3 = (k/N)*100
-        probability_ratio = (k/N)/((n-k)/(M-N))    
+# Motifs fréquents (FP-growth) : [k, N] pour chaque combinaison de prédicteurs
+# En dessous de min_testable_support, aucun motif (ni ses sur-motifs) ne peut être significatif
+patterns = fp_growth(transactions, max(min_support, min_testable_support(n, M, ALPHA)), max_length)
 
-        res.append([list(pat), pvalue, oddsr, probability_ratio, percent_M1M2, percent_M1M3])
+# On calcule le test exact de Fisher pour tous les motifs en une fois
+pats = list(patterns)
+N = np.array([patterns[pat][1] for pat in pats])
+k = np.array([patterns[pat][0] for pat in pats])
+stats = fisher_batch(k, n, N, M)
 
-res_sorted = sorted(res, key = lambda x: (x[1], -x[3]))
-res_sorted_len = sorted(res, key = lambda x: len(x[0]))
+res = []
+for i in np.flatnonzero(stats["pvalue"] < ALPHA):
+    res.append([list(pats[i]), stats["pvalue"][i], stats["oddsr"][i], stats["probability_ratio"][i], stats["percent_M1M2"][i], stats["percent_M1M3"][i], stats["log10_pvalue"][i]])
 
-# On filtre les résultats pour garder les motifs et sous-motifs plus significatifs
-patterns, visited = set(), set()
-
-for res in res_sorted_len:
-    to_keep = set()
-    pat, pvalue, _, PR, _, _ = res
-    for xres in res_sorted_len:
-        if set(pat).issubset(set(xres[0])):
-            xpat, xpvalue, _, xPR, _, _ = xres
-            if xpvalue < pvalue:
-                to_keep.add(tuple(xpat))
-            elif xpvalue == pvalue and xPR > PR:
-                to_keep.add(tuple(xpat))
-            elif xpvalue == pvalue and xPR == PR:
-                if pat != xpat:
-                    visited.add(tuple(xpat))
-                else:
-                    to_keep.add(tuple(pat))
-            else:
-                visited.add(tuple(xpat))
-    patterns.update(to_keep)
+# Tri par log10(p) : les p-values à 0.0 (underflow) restent ordonnées
+res_sorted = sorted(res, key = lambda x: (x[6], -x[3]))
 
-patterns.difference_update(visited)
+# On filtre les résultats pour garder les motifs et sous-motifs plus significatifs
+# (chaque motif n'est comparé qu'à ses sous-motifs, retrouvés dans un trie)
+keep = dominant_patterns([x[0] for x in res], [x[6] for x in res], [x[3] for x in res])
+patterns = {tuple(res[i][0]) for i in keep}
 
 with open(f"../results/{filename}-fisher-{treebank.split('.')[0]}.txt", "w", encoding="utf-8") as f:
     f.write(f"pattern\tp-value\tPR\tpercentage k/M1&M2\tpercentage k/M1&M3\n")
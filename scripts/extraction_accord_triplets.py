@@ -4,44 +4,29 @@ import json
 from pathlib import Path
 from collections import namedtuple, Counter
 import numpy as np
-from scipy.stats import fisher_exact
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "tool"))
+from treebank_cache import load_treebank
+from significance import fisher_batch
 
 def conll_to_dict(path : str) -> dict:
 
     p = "../treebanks/" + path
-    with open (p) as f:
-        conll = f.read().strip()
-        
-    trees = dict()
-    sentences = [x.split("\n") for x in conll.split("\n\n")]
-    for sent in sentences:
-        for line in sent:
-            if line.startswith("#"):
-                if "sent_id" in line:
-                    sent_id = line.split("=")[1].strip()
-                    trees[sent_id] = {}
-                    trees[sent_id]['0'] = ({"form" : "None"})
-            else:
-                token_id, form, lemma, upos, xpos, feats, head, deprel, deps, misc = line.split("\t")
-                if "-" not in token_id:
-                    #trees[sent_id][token_id] = ({"form" : form, "lemma" : lemma, "upos" : upos, "deprel" : deprel})
-                    trees[sent_id][token_id] = ({"upos" : upos, "deprel" : deprel})
-                    if feats != "_":
-                        features = [f.split("=") for f in feats.split("|")]
-                        dict_features = {lst[0]:lst[1] for lst in features}
-                        trees[sent_id][token_id].update(dict_features)
-    return trees
+    return load_treebank(p, fields=("upos", "deprel"))
 
 
 # Variables
 treebank = 'fr_gsd-sud.conllu'
-feature = "Gender"
+# Tous les traits sont traités en un seul passage sur les matchs de X->Y
+features = ["Gender", "Number", "Person"]
 
 # Parser le conllu
 corpus = conll_to_dict(treebank)
 
 # Récupérer toutes les phrases contenant le motif en utilisant Grew
-pattern = f'pattern {{X->Y; X[{feature}]; Y[{feature}]}}'
+# (X[feature]; Y[feature] est vérifié ensuite pour chaque trait)
+pattern = 'pattern {X->Y}'
 with open("tmp.pat","w", encoding="utf-8") as f: 
     f.write(pattern)
     
@@ -60,59 +45,52 @@ for m in lst_match:
     Y = m['matching']['nodes']['Y']
     to_recover.append(tpl_match(m['sent_id'], X, Y))
 
-# Liste de dictionnaires avec les variables de chaque match
-lst_predictors = []
+# Combinaisons des succès et de non-succès de chaque trait, en un seul passage
+comb_agree = {feature : Counter() for feature in features}
+comb_desagree = {feature : Counter() for feature in features}
 for tpl in to_recover:
-    dict_res = {}
-    for k, v in corpus[tpl.sent_id][tpl.X].items():
-        dict_res['X.'+k] = v
-    for k, v in corpus[tpl.sent_id][tpl.Y].items():
-        dict_res['Y.'+k] = v
-    lst_predictors.append(dict_res)
-
-# Combinaisons des succès et de non-succès
-comb_agree = Counter([f"X[upos={lst['X.upos']}]; Y[upos={lst['Y.upos']}]; X-[{lst['Y.deprel']}]->Y" for lst in lst_predictors if lst[f'X.{feature}'] == lst[f'Y.{feature}']])
-comb_desagree = Counter([f"X[upos={lst['X.upos']}]; Y[upos={lst['Y.upos']}]; X-[{lst['Y.deprel']}]->Y" for lst in lst_predictors if lst[f'X.{feature}'] != lst[f'Y.{feature}']])
-
-# Nombre total de succès
-n_agree = sum(comb_agree.values())
-n = n_agree
-
-# Nombre total de non-succès
-n_desagree = sum(comb_desagree.values())
-
-# Le nombre total d'occurrences
-M = n_agree + n_desagree
-
-# Compter les succès séparément par motif
-dict = {}
-for pattern, agree in comb_agree.items():
-    try :
-        desagree = comb_desagree[pattern]
-    except KeyError:
-        desagree = 0
-    dict[pattern] = {"agree" : agree, "desagree" : desagree}
-
-# On calcule le test exact de Fisher pour chaque motif
-results = {}
-
-for pat in dict:
-    k = dict[pat]["agree"]
-    N = k + dict[pat]["desagree"]
-    table = np.array([[k, n-k], [N-k, M - (n + N) + k]])
-    oddsr, pvalue = fisher_exact(table=table, alternative='greater')
-    percent_M1M2 = (k/n)*100
-    percent_M1M3 = (k/N)*100
-    probability_ratio = (k/N)/((n-k)/(M-N))
-    results[pat] = {"pvalue" : pvalue, "oddsr" : oddsr, "probability_ratio" : probability_ratio, "percent_M1M2" : percent_M1M2, "percent_M1M3" : percent_M1M3}
-
-sorted_results = sorted(results.items(), key=lambda x:x[1]["pvalue"],reverse=False)
-
-with open(f"../results/accord-{feature}-triplets-{treebank.split('.')[0]}.txt", "w", encoding="utf-8") as f:
-    f.write(f"pattern\tp-value\tprobability ratio\tpercentage k/M1&M2\t percentage k/M1&M3\n")
-    for res in sorted_results:
-        if res[1]['pvalue'] < 0.01:
-            f.write(f"{res[0]}\t{res[1]['pvalue']}\t{res[1]['probability_ratio']}\t{res[1]['percent_M1M2']}\t{res[1]['percent_M1M3']}\n")
-        else:
+    X, Y = corpus[tpl.sent_id][tpl.X], corpus[tpl.sent_id][tpl.Y]
+    triplet = f"X[upos={X['upos']}]; Y[upos={Y['upos']}]; X-[{Y['deprel']}]->Y"
+    for feature in features:
+        # Équivalent de X[feature]; Y[feature] dans le motif
+        if feature in X and feature in Y:
+            if X[feature] == Y[feature]:
+                comb_agree[feature][triplet] += 1
+            else:
+                comb_desagree[feature][triplet] += 1
+
+
+def write_results(feature : str, comb_agree : Counter, comb_desagree : Counter):
+
+    # Nombre total de succès
+    n_agree = sum(comb_agree.values())
+    n = n_agree
+
+    # Nombre total de non-succès
+    n_desagree = sum(comb_desagree.values())
+
+    # Le nombre total d'occurrences
+    M = n_agree + n_desagree
+
+    # On calcule le test exact de Fisher pour tous les motifs en une fois
+    # (comme avant, seulement les motifs avec au moins un accord)
+    pats = list(comb_agree)
+    k = np.array([comb_agree[pat] for pat in pats], dtype=int)
+    N = k + np.array([comb_desagree[pat] for pat in pats], dtype=k.dtype)
+    stats = fisher_batch(k, n, N, M)
+
+    results = {}
+    for i, pat in enumerate(pats):
+        results[pat] = {key : values[i] for key, values in stats.items()}
+
+    # Tri par log10(p) : les p-values à 0.0 (underflow) restent ordonnées
+    sorted_results = sorted(results.items(), key=lambda x:x[1]["log10_pvalue"],reverse=False)
+
+    with open(f"../results/accord-{feature}-triplets-{treebank.split('.')[0]}.txt", "w", encoding="utf-8") as f:
+        f.write(f"pattern\tp-value\tprobability ratio\tpercentage k/M1&M2\t percentage k/M1&M3\n")
+        for res in sorted_results:
             f.write(f"{res[0]}\t{res[1]['pvalue']}\t{res[1]['probability_ratio']}\t{res[1]['percent_M1M2']}\t{res[1]['percent_M1M3']}\n")
 
+
+for feature in features:
+    write_results(feature, comb_agree[feature], comb_desagree[feature])
@@ -3,33 +3,16 @@ import json
 from pathlib import Path
 from collections import namedtuple, Counter
 import numpy as np
-from scipy.stats import fisher_exact
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "tool"))
+from treebank_cache import load_treebank
+from significance import fisher_batch
 
 def conll_to_dict(path : str) -> dict:
 
     p = "../treebanks/" + path
-    with open (p) as f:
-        conll = f.read().strip()
-        
-    trees = dict()
-    sentences = [x.split("\n") for x in conll.split("\n\n")]
-
-    for sent in sentences:
-        for line in sent:
-            if line.startswith("#"):
-                if "sent_id" in line:
-                    sent_id = line.split("=")[1].strip()
-                    trees[sent_id] = {}
-                    trees[sent_id]['0'] = ({"form" : "None", "upos": "None", "lemma": "None"})
-            else:
-                token_id, form, lemma, upos, xpos, feats, head, deprel, deps, misc = line.split("\t")
-                if "-" not in token_id:
-                    trees[sent_id][token_id] = ({"upos" : upos, "deprel" : deprel, "lemma" : lemma})
-                    if feats != "_":
-                        features = [f.split("=") for f in feats.split("|")]
-                        dict_features = {lst[0]:lst[1] for lst in features}
-                        trees[sent_id][token_id].update(dict_features)
-    return trees
+    return load_treebank(p, fields=("upos", "deprel", "lemma"), root={"form" : "None", "upos": "None", "lemma": "None"})
 
 
 pattern2test = "Acc"
@@ -92,21 +75,18 @@ for pattern, yes in comb_yes.items():
         no = 0
     dict[pattern] = {"yes" : yes, "no" : no}
 
-# On calcule le test exact de Fisher pour chaque motif
-results = {}
-
-for pat in dict:
-    k = dict[pat]["yes"]
-    N = k + dict[pat]["no"]
-    table = np.array([[k, n-k], [N-k, M - (n + N) + k]])
-    oddsr, pvalue = fisher_exact(table=table, alternative='greater')
-    percent_M1M2 = (k/n)*100
-    percent_M1M3 = (k/N)*100
-    probability_ratio = (k/N)/((n-k)/(M-N))
-    results[pat] = {"pvalue" : pvalue, "oddsr" : oddsr, "probability_ratio" : probability_ratio, "percent_M1M2" : percent_M1M2, "percent_M1M3" : percent_M1M3}
+# On calcule le test exact de Fisher pour tous les motifs en une fois
+pats = list(dict)
+k = np.array([dict[pat]["yes"] for pat in pats])
+N = k + np.array([dict[pat]["no"] for pat in pats])
+stats = fisher_batch(k, n, N, M)
 
+results = {}
+for i, pat in enumerate(pats):
+    results[pat] = {key : values[i] for key, values in stats.items()}
 
-sorted_results = sorted(results.items(), key=lambda x:x[1]["pvalue"],reverse=False)
+# Tri par log10(p) : les p-values à 0.0 (underflow) restent ordonnées
+sorted_results = sorted(results.items(), key=lambda x:x[1]["log10_pvalue"],reverse=False)
 
 with open(f"../results/noun-{pattern2test}-{feature}-{treebank.split('.')[0]}.txt", "w", encoding="utf-8") as f:
     f.write(f"pattern\tp-value\tprobability ratio\tpercentage k/M1&M2\t percentage k/M1&M3\n")
@@ -1,10 +1,13 @@
 from grew import grew, corpus_count
 import numpy as np
-import subprocess
+import sys
 from pathlib import Path
 import re
 from numpy import inf
-from scipy.stats import fisher_exact
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "tool"))
+from grew_session import GrewSession
+from significance import fisher_batch
 
 def concat_patterns(*pattern : str) -> str:
     res = ";".join(pattern)
@@ -23,21 +26,17 @@ M2 = "X << Y"
 M3 = "e:H->X"
 
 
-# Indexation du corpus en utilisant grew
-corpus_index = grew.corpus(conll)
+# Compter les valeurs de e.label via une session grew (corpora chargés une seule fois),
+# sur le serveur grew démarré plus haut
+session = GrewSession(f"../treebanks/{corpora}.json")
 
-# Récupérer toutes les phrases contenant le motif en utilisant Grew
-with open("tmp.pat","w", encoding="utf-8") as file: 
-    file.write(concat_patterns(M1, M2, M3))
-subprocess.check_output(f"grew compile -i ../treebanks/{corpora}.json".split(), stderr=subprocess.STDOUT)
-command = f"grew count -pattern tmp.pat -key e.label -i ../treebanks/{corpora}.json".split()
-tsv = subprocess.check_output(command, stderr=subprocess.STDOUT).decode("utf-8").strip()
-tmp_file = Path("tmp.pat").resolve()
-Path.unlink(tmp_file)  
+# Indexation du corpus en utilisant grew (même serveur que la session)
+corpus_index = grew.corpus(conll)
+k_by_label = session.grew_count(M1, M2, M3, cluster="key", key_pattern="e.label")
 
 # Récupérer les valeurs fixes via Grew
-M3_patterns = tsv.split("\n")[0].split("\t")[1:]
-k_values = tsv.split("\n")[1].split("\t")[1:]
+M3_patterns = list(k_by_label)
+k_values = list(k_by_label.values())
 basic_M3 = re.sub(r"^e:", "", M3)
 
 M_pattern = concat_patterns(M1)
@@ -47,26 +46,22 @@ M = corpus_count(pattern = M_pattern, corpus_index = corpus_index)
 n = corpus_count(pattern = n_pattern, corpus_index = corpus_index)
 
 
-# On calcule le test exact de Fisher pour chaque motif
-results = dict()
-
-for m, k in zip(M3_patterns, k_values):
-
+# N de chaque motif via Grew, puis le test exact de Fisher pour tous les motifs en une fois
+N_values = []
+for m in M3_patterns:
     M3 = basic_M3
     M3 = re.sub(r"->", f"-[{m}]->", M3)
     N_pattern = concat_patterns(M1, M3)
-    N = corpus_count(pattern = N_pattern, corpus_index = corpus_index)
-    k = int(k)
+    N_values.append(corpus_count(pattern = N_pattern, corpus_index = corpus_index))
 
-    table = np.array([[k, n-k], [N-k, M - (n + N) + k]])
-    oddsr, p_value = fisher_exact(table = table, alternative='greater')
-    percent_M1M2 = (k/n)*100
-    percent_M1M3 = (k/N)*100
-    probability_ratio = (k/N)/((n-k)/(M-N))
+stats = fisher_batch(np.array(k_values, dtype=int), n, np.array(N_values), M)
 
-    results[m] = {"pvalue" : p_value, "oddsr" : oddsr, "probability_ratio" : probability_ratio, "percent_M1M2" : percent_M1M2, "percent_M1M3" : percent_M1M3}
+results = dict()
+for i, m in enumerate(M3_patterns):
+    results[m] = {key : values[i] for key, values in stats.items()}
 
-sorted_results = sorted(results.items(), key=lambda x:x[1]["pvalue"],reverse=False)
+# Tri par log10(p) : les p-values à 0.0 (underflow) restent ordonnées
+sorted_results = sorted(results.items(), key=lambda x:x[1]["log10_pvalue"],reverse=False)
 
 with open(f"../results/{name}-{conll.split('.')[0]}.txt", "w", encoding="utf-8") as f:
     f.write(f"pattern\tp-value\tprobability ratio\tpercentage k/M1&M2\t percentage k/M1&M3\n")
@@ -0,0 +1,145 @@
+import argparse
+import json
+import re
+import sys
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+import grew
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "tool"))
+from corpora import load_corpora
+from treebank_cache import load_treebank
+from contingency import build_contingency
+from query_cache import QueryCache
+from pattern_filter import dominant_patterns
+from significance import ALPHA, fisher_patterns
+
+# ------------------ Lancement de plusieurs études ------------------
+#
+# Les études (P1, P2, P3) de chaque corpus sont décrites dans un fichier json
+# (voir studies.json). Chaque corpus est chargé et indexé une seule fois ; les
+# études qui partagent P1 sont lancées ensemble, les recherches de P1 (et de
+# P1&P2) passant par le même cache de requêtes. Chaque étude écrit son
+# fichier de résultats au format de results/*.txt :
+#   "pattern" : X[upos=NOUN]; Y[upos=DET]; X-[det]->Y
+#   "list"    : ['X-[det]->Y', 'Y[upos=DET]']
+#   "tuple"   : ('VERB', 'comp:obj')
+#   "value"   : parataxis
+#
+# Champs d'une étude : name, P1, P2, P3, output, format, et optionnellement
+# all (toutes les combinaisons, -a), significant (seulement p < 0.01),
+# dominant (filtre des sous-motifs plus significatifs), exclude (prédicteurs
+# retirés de "X.*" : "X.upos" retire ce prédicteur, "Number" tous les traits
+# qui contiennent Number), min_support et max_length.
+
+HEADERS = {
+    "list" : "#pattern\tp-value\tPR\tpercentage k/M1&M2\tpercentage k/M1&M3\n",
+    "default" : "#pattern\tp-value\tprobability ratio\tpercentage k/M1&M2\t percentage k/M1&M3\n",
+}
+
+# Les champs qui ne sont pas des prédicteurs dans "X.*"
+NOT_PREDICTORS = ("form", "lemma", "deprel")
+
+def load(path : Path) -> Tuple[int, object]:
+    "Index grew et treebank d'un conllu ou d'un json de corpora"
+    if path.suffix == ".json":
+        files, treebank = load_corpora(str(path))
+        return grew.corpus(files), treebank
+    return grew.corpus(str(path)), load_treebank(str(path))
+
+def expand_predictors(P3 : str, treebank, exclude : List[str]) -> str:
+    "X.* -> X.upos; X.Gender... (tous les traits du treebank sauf ceux de exclude)"
+    res = []
+    for clause in [c.strip() for c in P3.split(";") if c.strip()]:
+        re_match = re.fullmatch(r"(\w+)\.\*", clause)
+        if re_match is None:
+            res.append(clause)
+            continue
+        node = re_match.group(1)
+        for attr in treebank.attributes:
+            # Comme dans les scripts ("Number" not in x) : "Number" retire aussi Number[psor]
+            if attr in NOT_PREDICTORS or f"{node}.{attr}" in exclude or any(e in attr for e in exclude if "." not in e):
+                continue
+            res.append(f"{node}.{attr}")
+    # Un prédicteur donné deux fois n'est gardé qu'à sa première place
+    return "; ".join(dict.fromkeys(res))
+
+def item_value(item : str) -> str:
+    "X[upos=VERB] -> VERB, H-[comp:obj]->X -> comp:obj"
+    re_match = re.search(r"-\[(.+?)\]->", item) or re.search(r"\[\w+=(.*)\]", item)
+    return re_match.group(1).strip('"')
+
+def format_result(pattern : str, fmt : str) -> str:
+    items = pattern.split("; ")
+    if fmt == "list":
+        return str(items)
+    if fmt == "tuple":
+        return str(tuple(item_value(item) for item in items))
+    if fmt == "value":
+        return ", ".join(item_value(item) for item in items)
+    return pattern
+
+def study_rows(study : Dict, treebank_idx : int, treebank, queries) -> List[Tuple[str, float, float, float, float]]:
+    "(motif formaté, p-value, PR, % k/M1&M2, % k/M1&M3) des motifs de l'étude, triés"
+    significant_only = study.get("significant", False)
+    P3 = expand_predictors(study["P3"], treebank, study.get("exclude", []))
+    M, n, counts = build_contingency(treebank_idx, treebank, study["P1"], study["P2"], P3, study.get("all", False), quote=False, queries=queries,
+                                     min_support=study.get("min_support", 1), max_length=study.get("max_length"),
+                                     alpha=ALPHA if significant_only else None)
+    patterns, stats = fisher_patterns(counts, n, M)
+
+    # Comme dans les scripts : les motifs significatifs, ou tous ceux qui ont au moins un succès
+    rows = np.flatnonzero(stats["pvalue"] < ALPHA) if significant_only else np.array([i for i, pat in enumerate(patterns) if counts[pat][0] > 0], dtype=np.int64)
+    if study.get("dominant", False):
+        keep = dominant_patterns([patterns[i].split("; ") for i in rows], stats["log10_pvalue"][rows], stats["probability_ratio"][rows])
+        rows = rows[keep]
+    # Tri par log10(p) : les p-values à 0.0 (underflow) restent ordonnées
+    rows = sorted(rows, key=lambda i: (stats["log10_pvalue"][i], -stats["probability_ratio"][i]))
+
+    fmt = study.get("format", "pattern")
+    return [(format_result(patterns[i], fmt), float(stats["pvalue"][i]), float(stats["probability_ratio"][i]), float(stats["percent_M1M2"][i]), float(stats["percent_M1M3"][i])) for i in rows]
+
+def write_rows(path : Path, rows : List[Tuple], fmt : str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HEADERS.get(fmt, HEADERS["default"]))
+        for row in rows:
+            f.write("\t".join(str(x) for x in row) + "\n")
+
+def run_study(study : Dict, treebank_idx : int, treebank, queries : QueryCache, output_dir : Path):
+    rows = study_rows(study, treebank_idx, treebank, queries)
+    write_rows(output_dir / study["output"], rows, study.get("format", "pattern"))
+    print(f"{study['name']}: {len(rows)} patterns -> {study['output']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the extraction studies of a json spec, one pass per corpus')
+    parser.add_argument('spec', type=Path, help='json file describing the corpora and their studies')
+    parser.add_argument('--output', type=Path, default=None, help='directory of the results files (default: results/ of the repository)')
+    parser.add_argument('--only', nargs='*', default=None, help='names of the studies to run')
+    args = parser.parse_args()
+
+    spec = json.loads(args.spec.read_text(encoding="utf-8"))
+    output_dir = args.output or Path(__file__).resolve().parents[1] / "results"
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    grew.init()
+    for corpus in spec["corpora"]:
+        studies = [s for s in corpus["studies"] if args.only is None or s["name"] in args.only]
+        if not studies:
+            continue
+        # Chemins relatifs au fichier de spécification
+        path = (args.spec.resolve().parent / corpus["treebank"]).resolve()
+        treebank_idx, treebank = load(path)
+        queries = QueryCache()
+        queries.register(treebank_idx, treebank.fingerprint)
+        print(f"{path.name}: {len(treebank)} sentences")
+        # Les études de même P1 à la suite : ses matchs ne sont cherchés qu'une fois
+        for P1, group in groupby(sorted(studies, key=lambda s: s["P1"]), key=lambda s: s["P1"]):
+            for study in group:
+                run_study(study, treebank_idx, treebank, queries, output_dir)
+        stats = queries.stats()
+        print(f"Query cache: {stats['hits']} hits, {stats['misses']} misses")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import grew
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "tool"))
+from corpora import corpora_files, load_files
+from query_cache import QueryCache
+from run_studies import study_rows, write_rows
+
+# ------------------ Une étude sur plusieurs treebanks ------------------
+#
+# La même étude (un objet de studies.json) est lancée sur une liste de
+# treebanks : fichiers conllu, json de corpora, dossiers d'un treebank SUD
+# (tous ses conllu) ou dossier contenant des treebanks SUD. Chaque treebank
+# est traité par un nouveau processus du pool, dont la mémoire est bornée par
+# --memory-mb (RLIMIT_AS, hérité par le serveur grew du processus). Chaque
+# treebank a son fichier de résultats, puis un tableau réunit les p-values et
+# PR de tous les treebanks par motif.
+
+def find_treebanks(paths : List[str]) -> Dict[str, List[str]]:
+    "Nom du treebank -> ses fichiers conllu"
+    treebanks = {}
+    for p in map(Path, paths):
+        if p.suffix == ".json":
+            treebanks[p.stem] = corpora_files(p)
+        elif p.is_file():
+            treebanks[p.name.split(".")[0]] = [str(p)]
+        elif any(p.glob("*.conllu")):
+            treebanks[p.name] = sorted(str(f) for f in p.glob("*.conllu"))
+        else:
+            # Dossier de treebanks SUD : un treebank par sous-dossier
+            for d in sorted(d for d in p.iterdir() if d.is_dir() and any(d.glob("*.conllu"))):
+                treebanks[d.name] = sorted(str(f) for f in d.glob("*.conllu"))
+    return treebanks
+
+def start_worker(memory_mb : Optional[int]):
+    if memory_mb:
+        limit = memory_mb * 2**20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    grew.init()
+
+def run_treebank(name : str, files : List[str], study : Dict, output_dir : Path) -> Tuple[str, List[Tuple]]:
+    "Lance l'étude sur un treebank (dans un processus du pool) et écrit ses résultats"
+    treebank_idx = grew.corpus(files)
+    treebank = load_files(files, processes=1)
+    queries = QueryCache()
+    queries.register(treebank_idx, treebank.fingerprint)
+    rows = study_rows(study, treebank_idx, treebank, queries)
+    write_rows(output_dir / f"{study['name']}-{name}.txt", rows, study.get("format", "pattern"))
+    return name, rows
+
+def write_merged(path : Path, results : Dict[str, List[Tuple]]):
+    "Un motif par ligne, p-value et PR de chaque treebank (vide si le motif n'y est pas)"
+    names = sorted(results)
+    by_pattern = {}
+    for name in names:
+        for pattern, pvalue, PR, _, _ in results[name]:
+            by_pattern.setdefault(pattern, {})[name] = (pvalue, PR)
+    # Les motifs les plus significatifs, dans le plus de treebanks, d'abord
+    patterns = sorted(by_pattern, key=lambda pat: (-len(by_pattern[pat]), min(p for p, _ in by_pattern[pat].values())))
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("#pattern\t" + "\t".join(f"p-value {name}\tPR {name}" for name in names) + "\n")
+        for pat in patterns:
+            cells = []
+            for name in names:
+                pvalue, PR = by_pattern[pat].get(name, ("", ""))
+                cells += [str(pvalue), str(PR)]
+            f.write(f"{pat}\t" + "\t".join(cells) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs one extraction study on several treebanks in parallel')
+    parser.add_argument('study', type=Path, help='json file with one study, or a studies spec (with --name)')
+    parser.add_argument('treebanks', nargs='+', help='conllu files, corpora json, SUD treebank directories or a directory of SUD treebanks')
+    parser.add_argument('--name', default=None, help='name of the study in a studies spec')
+    parser.add_argument('--output', type=Path, default=None, help='directory of the results files (default: results/ of the repository)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--memory-mb', type=int, default=None, help='address space limit of each worker (and of its grew server)')
+    args = parser.parse_args()
+
+    study = json.loads(args.study.read_text(encoding="utf-8"))
+    if "corpora" in study:
+        study = next(s for corpus in study["corpora"] for s in corpus["studies"] if s["name"] == args.name)
+    output_dir = args.output or Path(__file__).resolve().parents[1] / "results"
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    treebanks = find_treebanks(args.treebanks)
+    results = {}
+    # spawn + une tâche par processus : chaque treebank a un nouveau serveur grew,
+    # la mémoire des corpus déjà traités (jamais libérée par grew) ne s'accumule pas
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(args.processes, len(treebanks)) or 1, mp_context=context, initializer=start_worker, initargs=(args.memory_mb,), max_tasks_per_child=1) as executor:
+        futures = {executor.submit(run_treebank, name, files, study, output_dir) : name for name, files in treebanks.items()}
+        for future in as_completed(futures):
+            try:
+                name, rows = future.result()
+            except MemoryError:
+                print(f"{futures[future]}: over the memory budget of {args.memory_mb} MB")
+                continue
+            except Exception as e:
+                print(f"{futures[future]}: failed ({e!r})")
+                continue
+            results[name] = rows
+            print(f"{name}: {len(rows)} patterns")
+
+    if results:
+        write_merged(output_dir / f"{study['name']}-merged.tsv", results)
+
+if __name__ == "__main__":
+    main()
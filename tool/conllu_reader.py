@@ -0,0 +1,64 @@
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+
+# ---------- Streaming CoNLL-U reader ----------
+#
+# The file is read line by line and only one sentence is held in memory at a
+# time, so the peak memory of the readers is bounded by the largest sentence
+# and not by the size of the treebank.
+
+# Position of each CoNLL-U column in a token line
+COLUMNS = {"id" : 0, "form" : 1, "lemma" : 2, "upos" : 3, "xpos" : 4, "feats" : 5, "head" : 6, "deprel" : 7, "deps" : 8, "misc" : 9}
+
+# Token attributes kept by default (the ones used by extraction_tool and rules4streamlit)
+FIELDS = ("form", "lemma", "upos", "deprel")
+
+# The root node '0' added to every sentence
+ROOT = {"form" : "None"}
+
+
+def iter_sentences(f : TextIO) -> Iterator[Tuple[str, List[List[str]]]]:
+    "Yield (sent_id, rows) for each sentence of f, rows being the token lines split on tabs (multiword tokens excluded)"
+    sent_id, rows = None, []
+    for line in f:
+        line = line.rstrip("\r\n")
+        if not line.strip():
+            if sent_id is not None:
+                yield sent_id, rows
+            sent_id, rows = None, []
+        elif line.startswith("#"):
+            if "sent_id" in line:
+                sent_id = line.split("=")[1].strip()
+        else:
+            cols = line.split("\t")
+            if "-" not in cols[0]:
+                rows.append(cols)
+    if sent_id is not None:
+        yield sent_id, rows
+
+
+def parse_feats(feats : str) -> Dict[str, str]:
+    if feats == "_":
+        return {}
+    features = [f.split("=") for f in feats.split("|")]
+    return {lst[0]:lst[1] for lst in features}
+
+
+def token_dict(cols : List[str], fields : Tuple[str, ...] = FIELDS) -> Dict[str, str]:
+    token = {field : cols[COLUMNS[field]] for field in fields}
+    token.update(parse_feats(cols[COLUMNS["feats"]]))
+    return token
+
+
+def read_sentences(f : TextIO, fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None) -> Iterator[Tuple[str, Dict]]:
+    "Yield (sent_id, {token_id : token}) for each sentence of f, tokens being dicts of fields + features"
+    root = ROOT if root is None else root
+    for sent_id, rows in iter_sentences(f):
+        tree = {'0' : dict(root)}
+        for cols in rows:
+            tree[cols[0]] = token_dict(cols, fields)
+        yield sent_id, tree
+
+
+def conllu2dict(path : str, fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None) -> Dict:
+    with open(path, encoding="utf-8") as f:
+        return dict(read_sentences(f, fields, root))
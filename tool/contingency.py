@@ -0,0 +1,218 @@
+import json, re
+from collections import defaultdict, Counter
+from itertools import combinations, chain, islice
+from typing import Dict, Iterator, List, Optional, Tuple
+import grew
+
+from occurrence_index import OccurrenceIndex
+from profiling import NO_TRACE
+from significance import min_testable_support
+
+# ---------- Contingency tables from the P1 matches ----------
+#
+# For every candidate pattern P3 the Fisher test needs
+#   M = #P1, n = #P1&P2, N = #P1&P3, k = #P1&P2&P3
+# Instead of one grew.corpus_count per number and per pattern, P1 and P1&P2
+# are searched once, each P1&P2 match is projected on the nodes of P1, and
+# the counts of every pattern are filled from the P1 matches in one pass.
+# iter_contingency gives the counts by batches while the patterns are mined,
+# so that they can be tested (and the mining stopped) before it is over.
+
+def format_pattern(*pattern : str) -> str:
+    res = ";".join(pattern)
+    res = f"pattern {{ {res} }}"
+    return res
+
+def powerset(iterable):
+    "powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
+    s = list(iterable)
+    return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
+
+def get_predictors(P1, P3):
+    # Get predictors in a dictionary
+    any_key = False
+    predictors = defaultdict(list)
+
+    # Boolean to handle querys with or without keys
+    # For the moment the script doesn't accept mixed querys (with and without keys)
+
+    for s in P3.split(';'):
+        # Node.feature, the feature possibly being layered (Y.Person[psor])
+        if re.search(r'^.+?\.\w+(\[\w+\])?$', s.strip()):
+            any_key = True
+            k, v = s.strip().split(".")
+            if v == "label":
+                re_match = re.search(fr"{k}:(\w+?)->(\w+?)", P1)
+                predictors[re_match.group(2)].append(["deprel", {"head" : re_match.group(1), "dep" : re_match.group(2)}])
+            else:
+                predictors[k].append(v)
+    return predictors, any_key
+
+def match_key(m, nodes, edges=()) -> Tuple:
+    "Identity of a match restricted to the given node (and edge) names"
+    matching = m["matching"]
+    key = tuple((node, matching["nodes"][node]) for node in nodes)
+    if edges:
+        key += tuple((edge, json.dumps(matching["edges"][edge], sort_keys=True)) for edge in edges)
+    return (m["sent_id"],) + key
+
+def match_names(matchs) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    "Node and edge names of the matches of a pattern"
+    if not matchs:
+        return (), ()
+    matching = matchs[0]["matching"]
+    return tuple(sorted(matching["nodes"])), tuple(sorted(matching.get("edges", {})))
+
+def project(matchs, nodes, edges) -> Counter:
+    "Number of matches of an extension of P1 above each P1 match"
+    return Counter(match_key(m, nodes, edges) for m in matchs)
+
+def get_items(m, treebank, predictors, quote : bool = True) -> List[Tuple[Tuple[str, str], str]]:
+    "Predictor values of a P1 match, as grew clauses with their slot (node, feature)"
+    lst = []
+    for node, idx in m["matching"]["nodes"].items():
+        if not predictors[node]:
+            continue
+        # Values read by row (no Sentence/Token views in this loop)
+        row = treebank.token_row(m["sent_id"], idx)
+        for var in predictors[node]:
+            # If it's a list is a deprel with a head and a dep
+            if isinstance(var, list):
+                slot = (node, "label")
+                p = f'{var[1]["head"]}-[{treebank.get(row, var[0])}]->{node}'
+            else:
+                # Handling Node[Feature=Value]
+                value = treebank.get(row, var)
+                if value is None:
+                    continue
+                slot = (node, var)
+                p = f'{node}[{var}="{value}"]' if quote else f'{node}[{var}={value}]'
+            lst.append((slot, p))
+    return lst
+
+def outcome_weights(treebank_idx, P1, P2, queries = grew) -> Tuple[List, Tuple[str, ...], Tuple[str, ...], List[int], int, int]:
+    "P1 matches (with their node and edge names), the number of P1&P2 matches above each of them, M and n"
+    matchs = queries.corpus_search(format_pattern(P1), treebank_idx)
+    nodes, edges = match_names(matchs)
+    outcome = project(queries.corpus_search(format_pattern(P1, P2), treebank_idx), nodes, edges)
+    weights = [outcome[match_key(m, nodes, edges)] for m in matchs]
+    return matchs, nodes, edges, weights, len(matchs), sum(outcome.values())
+
+def batches(items, size : int, trace, phase : str):
+    "Lists of up to size items, each one taken in the trace phase (the time of the caller between two lists isn't counted)"
+    items = iter(items)
+    while True:
+        with trace.phase(phase):
+            batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+def build_contingency(treebank_idx, treebank, P1, P2, P3, option, quote : bool = True, queries = grew, min_support : int = 1, max_length : Optional[int] = None, alpha : Optional[float] = None, closed : bool = False, trace = None) -> Tuple[int, int, Dict[str, Tuple[int, int]]]:
+    """M, n and {pattern : (k, N)} for the patterns of P3 (all combinations if option), queries being grew or a QueryCache.
+    With option, only the combinations of at most max_length items occurring in at least min_support matches are counted.
+    With alpha, the patterns whose support is too low to ever reach a p-value below alpha are left out.
+    With closed (and option), only the largest pattern of each set of matches is kept, as (k, N, number of patterns of the set).
+    With a trace (profiling.Trace), the phases and the grew calls are timed"""
+
+    counts = {}
+    for M, n, batch in iter_contingency(treebank_idx, treebank, P1, P2, P3, option, quote, queries, min_support, max_length, alpha, closed, trace):
+        counts.update(batch)
+    return M, n, counts
+
+def iter_contingency(treebank_idx, treebank, P1, P2, P3, option, quote : bool = True, queries = grew, min_support : int = 1, max_length : Optional[int] = None, alpha : Optional[float] = None, closed : bool = False, trace = None, batch_size : int = 2000) -> Iterator[Tuple[int, int, Dict[str, Tuple[int, int]]]]:
+    """build_contingency by steps: yields M, n and the counts of the patterns found since the previous step
+    (none after the P1 search and while the closed patterns are mined), so that the patterns can be tested while mining.
+    Closing the iterator stops the mining"""
+
+    trace = trace or NO_TRACE
+    queries = trace.queries(queries)
+    predictors, any_key = get_predictors(P1, P3)
+    with trace.phase("P1 search"):
+        matchs, nodes, edges, weights, M, n = outcome_weights(treebank_idx, P1, P2, queries)
+    trace.count("P1 matches", M)
+    yield M, n, {}
+    if alpha is not None:
+        # Below this support no pattern (and no superset of it) can be significant
+        min_support = max(min_support, min_testable_support(n, M, alpha))
+    found = 0
+
+    if any_key:
+        # Predictor values are read in the treebank for each match, and indexed as bitsets over the matches
+        with trace.phase("predictor extraction"):
+            rows = [get_items(m, treebank, predictors, quote) for m in matchs]
+            index = OccurrenceIndex(rows, weights)
+        # Handling option
+        if option and closed:
+            # closed combinations: one per set of matches, known once the walk is over
+            walk, classes = index.iter_closed(min_support, max_length), None
+            while classes is None:
+                with trace.phase("combinations"):
+                    try:
+                        next(walk)
+                    except StopIteration as stop:
+                        classes = stop.value
+                if classes is None:
+                    yield M, n, {}
+            combs = classes.items()
+        elif option:
+            # frequent combinations (depth first, one AND per extension)
+            combs = index.iter_eclat(min_support, max_length)
+        else:
+            # largest combinations: the matches with exactly these items.
+            # k is counted on these N matches: the original tool took grew's count of
+            # P1&P2&pattern, which also counted the matches having more items (k could
+            # exceed N and give a negative table), so the default mode ranks differently
+            largest = dict.fromkeys(tuple(item for _, item in row) for row in rows if row)
+            combs = ((items, kN) for items, kN in ((items, index.exact(items)) for items in largest) if alpha is None or kN[1] >= min_support)
+        for batch in batches(combs, batch_size, trace, "combinations"):
+            found += len(batch)
+            yield M, n, {"; ".join(items) : tuple(kN) for items, kN in batch}
+    else:
+        # Each clause of P3 is searched once with P1; a combination of clauses
+        # is then the intersection of their matches, as long as the clauses do
+        # not introduce new nodes (otherwise grew counts the combination)
+        clauses = [x.strip() for x in P3.split(";") if x.strip()] if option else [P3]
+        members = {}
+        with trace.phase("clause search"):
+            for clause in clauses:
+                res = queries.corpus_search(format_pattern(P1, clause), treebank_idx)
+                if all(match_names([r]) == (nodes, edges) for r in res):
+                    members[clause] = {match_key(r, nodes, edges) for r in res}
+        index = {match_key(m, nodes, edges) : w for m, w in zip(matchs, weights)}
+
+        combs = [c for c in powerset(clauses) if c and (max_length is None or len(c) <= max_length)] if option else [tuple(clauses)]
+
+        def clause_counts():
+            rare = set()
+            for c in combs:
+                projected = all(clause in members for clause in c)
+                # Apriori: the supersets of a rare combination are rare too (powerset goes by increasing length),
+                # as long as the matches are those of P1 (new nodes can multiply them)
+                if projected and len(c) > 1 and any(sub in rare for sub in combinations(c, len(c) - 1)):
+                    rare.add(c)
+                    continue
+                pat = "; ".join(c)
+                if projected:
+                    keys = set.intersection(*(members[clause] for clause in c))
+                    kN = [sum(index.get(key, 0) for key in keys), len(keys)]
+                else:
+                    with trace.phase("count N"):
+                        N = queries.corpus_count(pattern = format_pattern(P1, pat), corpus_index = treebank_idx)
+                    # k is only counted for the patterns kept
+                    kN = [0, N]
+                    if N >= min_support:
+                        with trace.phase("count k"):
+                            kN[0] = queries.corpus_count(pattern = format_pattern(P1, P2, pat), corpus_index = treebank_idx)
+                if (option or alpha is not None) and kN[1] < min_support:
+                    if projected:
+                        rare.add(c)
+                else:
+                    yield pat, tuple(kN)
+
+        # grew counts are slow: the patterns are given by smaller batches
+        for batch in batches(clause_counts(), max(1, batch_size // 100), trace, "combinations"):
+            found += len(batch)
+            yield M, n, dict(batch)
+
+    trace.count("patterns", found)
@@ -0,0 +1,63 @@
+import hashlib, json
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from conllu_reader import FIELDS
+from treebank_cache import DEFAULT_CACHE_DIR, load_treebank
+from treebank_store import Treebank, concat_treebanks
+
+# ---------- Corpora JSON (the -i file of grew) ----------
+#
+# {"corpora": [{"id": ..., "directory": ..., "files": [...]}, ...]}
+#
+# All the files are parsed in parallel (one process per file, each going
+# through the treebank cache) and merged into a single Treebank, in the order
+# of the JSON. sent_ids are kept as in the files so that they match the ones
+# returned by grew on the same files; the merge fails if two files share a
+# sent_id.
+
+
+def corpora_files(json_path : Union[str, Path], corpus_id : Optional[str] = None) -> List[str]:
+    json_path = Path(json_path)
+    with open(json_path, encoding="utf-8") as f:
+        corpora = json.load(f)["corpora"]
+    if corpus_id is not None:
+        corpora = [c for c in corpora if c["id"] == corpus_id]
+        if not corpora:
+            raise KeyError(f"No corpus {corpus_id} in {json_path}")
+
+    files = []
+    for corpus in corpora:
+        directory = json_path.parent / corpus["directory"]
+        if not directory.is_dir():
+            # JSON written on another machine: look for the directory next to the JSON
+            directory = json_path.parent / Path(corpus["directory"]).name
+        for filename in corpus["files"]:
+            path = directory / filename
+            if not path.is_file():
+                raise FileNotFoundError(f"{filename} of corpus {corpus['id']} not found in {directory}")
+            files.append(str(path))
+    return files
+
+
+def load_files(files : List[str], fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None, cache_dir : Optional[Union[str, Path]] = DEFAULT_CACHE_DIR, processes : Optional[int] = None) -> Treebank:
+    load = partial(load_treebank, fields=fields, root=root, cache_dir=cache_dir)
+    if len(files) == 1 or processes == 1:
+        treebanks = [load(path) for path in files]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            treebanks = list(executor.map(load, files))
+    if len(treebanks) == 1:
+        return treebanks[0]
+
+    treebank = concat_treebanks(treebanks)
+    treebank.fingerprint = hashlib.sha1("".join(tb.fingerprint for tb in treebanks).encode("utf-8")).hexdigest()
+    return treebank
+
+
+def load_corpora(json_path : Union[str, Path], corpus_id : Optional[str] = None, fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None, cache_dir : Optional[Union[str, Path]] = DEFAULT_CACHE_DIR, processes : Optional[int] = None) -> Tuple[List[str], Treebank]:
+    "Files listed in the corpora JSON and the merged Treebank of all of them"
+    files = corpora_files(json_path, corpus_id)
+    return files, load_files(files, fields, root, cache_dir, processes)
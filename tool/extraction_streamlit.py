@@ -1,5 +1,8 @@
+import json
 import grew
 import rules4streamlit as rules
+from jobs import JobQueue
+from profiling import Trace
 
 import streamlit as st
 import pandas as pd
@@ -18,15 +21,30 @@ Upload your treebank to query grammar rules.
 """
 )
 
+@st.cache_resource
+def start_grew():
+    # One grew server for all the sessions and reruns
+    grew.init()
+
+@st.cache_resource
+def corpus_pool() -> rules.CorpusPool:
+    return rules.CorpusPool()
+
+@st.cache_resource
+def job_queue() -> JobQueue:
+    # Worker processes shared by all the sessions
+    return JobQueue()
+
+
 uploaded_file = st.file_uploader("Upload CoNLL-U", type=".conllu")
 if not uploaded_file:
     st.info('Please upload a file')
     st.stop()
 
 with st.spinner('Loading treebank...'):
-    grew.init()
-    content = uploaded_file.read()
-    treebank_idx, treebank = rules.load_corpus(content, uploaded_file.name)
+    start_grew()
+    # Reruns and other sessions uploading the same file reuse the loaded corpus
+    treebank_idx, treebank = corpus_pool().get(uploaded_file.getvalue(), uploaded_file.name)
 
 
 with st.form("form"):
@@ -48,15 +66,67 @@ with st.form("form"):
         option = False
     else:
         option = True
+
+    dominant = st.checkbox("Keep only the patterns more significant than their sub-patterns")
+    closed = st.checkbox("Closed patterns only (one pattern per set of matches)")
+    background = st.checkbox("Run in background (results in the Background jobs section)")
+    profile = st.checkbox("Profile (time of each phase and number of grew calls)")
     
     submit = st.form_submit_button("Go!")
 
 
-if submit:
-    with st.spinner('Wait for it...'):
-        df = rules.rules_extraction(treebank_idx, treebank, P1, P2, P3, option)
-        st.dataframe(df)
-else:
+if submit and background:
+    # The extraction is queued for the worker processes, the session stays free
+    queue = job_queue()
+    corpus = queue.add_corpus(uploaded_file.getvalue(), uploaded_file.name)
+    job_id = queue.submit(corpus, P1, P2, P3, option, dominant=dominant, closed=closed)
+    st.session_state.setdefault("jobs", []).append(job_id)
+    st.success(f"Job {job_id} submitted")
+elif submit:
+    # Rows found so far, kept in the session: a click on Cancel reruns the script, which stops the extraction
+    st.session_state.rows, st.session_state.status = [], "running"
+    progress = st.progress(0.0, text="Counting the patterns...")
+    st.button("Cancel")
+    table = st.empty()
+    trace = Trace() if profile else None
+    for done, total, rows in rules.iter_rules(treebank_idx, treebank, P1, P2, P3, option, queries=rules.queries, dominant=dominant, closed=closed, trace=trace):
+        st.session_state.rows.extend(rows)
+        # The patterns are tested while they are mined: total grows until the mining is over
+        progress.progress(done / total if total else 0.0, text=f"{done} / {total} patterns tested")
+        if rows or done == total:
+            table.dataframe(rules.rules_frame(st.session_state.rows))
+    st.session_state.status = "done"
+    stats = rules.queries.stats()
+    st.caption(f"Query cache: {stats['hits']} hits, {stats['misses']} misses")
+    if trace is not None:
+        with st.expander("Profile"):
+            report = trace.report()
+            st.dataframe(pd.DataFrame.from_dict(report["phases"], orient="index"))
+            st.json(report["counters"])
+            st.download_button("Download the trace", json.dumps(report, indent=2), file_name="trace.json", mime="application/json")
+elif st.session_state.get("status") in ("running", "cancelled"):
+    st.session_state.status = "cancelled"
+    st.warning("Extraction cancelled, patterns found before:")
+    st.dataframe(rules.rules_frame(st.session_state.rows))
+elif st.session_state.get("status") == "done":
+    st.dataframe(rules.rules_frame(st.session_state.rows))
+elif not st.session_state.get("jobs"):
     st.info('Please complete the query patterns')
     st.stop()
 
+if st.session_state.get("jobs"):
+    st.subheader("Background jobs")
+    st.button("Refresh")
+    queue = job_queue()
+    for job_id in reversed(st.session_state.jobs):
+        status = queue.status(job_id)
+        if status == "unknown":
+            continue
+        query = queue.jobs[job_id].query
+        with st.expander(f"Job {job_id} ({status}): {query['P1']} | {query['P2']} | {query['P3']}", expanded=status == "done"):
+            if status == "done":
+                st.dataframe(rules.rules_frame(queue.result(job_id)))
+            elif status == "failed":
+                st.error(repr(queue.jobs[job_id].future.exception()))
+            elif status == "queued" and st.button("Cancel", key=f"cancel-{job_id}"):
+                queue.cancel(job_id)
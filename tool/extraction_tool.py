@@ -1,12 +1,15 @@
-import argparse, re
-from collections import defaultdict, Counter
-from itertools import combinations, chain
-from typing import Dict
-from scipy.stats import fisher_exact
+import argparse
 import numpy as np
 import grew
 
-import time
+from treebank_cache import DEFAULT_CACHE_DIR, load_treebank
+from corpora import load_corpora
+from contingency import build_contingency
+from incremental import CountState, sentence_matches
+from query_cache import QueryCache
+from significance import ALPHA, fisher_patterns, min_testable_support
+from profiling import NO_TRACE, Trace
+
 # -------------------------
 
 my_parser = argparse.ArgumentParser(description='Extraction of grammar rules from a treebank')
@@ -14,13 +17,59 @@ my_parser = argparse.ArgumentParser(description='Extraction of grammar rules fro
 my_parser.add_argument('Treebank',
                        metavar='Path',
                        type=str,
-                       help='the path to the conllu file')
+                       help='the path to the conllu file or to a corpora json (all its files are loaded)')
 
 my_parser.add_argument('-a',
                        '--all',
                        action='store_true',
                        help='an optional argument')
 
+my_parser.add_argument('--min-support',
+                       type=int,
+                       default=1,
+                       help='with -a, only the combinations occurring in at least this number of P1 matches are tested')
+
+my_parser.add_argument('--max-length',
+                       type=int,
+                       default=None,
+                       help='with -a, maximum number of predictors in a combination')
+
+my_parser.add_argument('--closed',
+                       action='store_true',
+                       help='with -a, only test the largest combination of each set of matches (its class size is printed)')
+
+my_parser.add_argument('--no-cache',
+                       action='store_true',
+                       help='parse the conllu file without using the treebank cache')
+
+my_parser.add_argument('--query-cache',
+                       metavar='Path',
+                       type=str,
+                       default=None,
+                       help='sqlite file keeping the results of the grew queries between runs')
+
+my_parser.add_argument('--state',
+                       metavar='Path',
+                       type=str,
+                       default=None,
+                       help='file keeping the counts of the query per sentence (written after the counting), with -a it needs --max-length')
+
+my_parser.add_argument('--update',
+                       action='store_true',
+                       help='with --state, the treebank only holds new or changed sentences, applied to the saved counts')
+
+my_parser.add_argument('--trace',
+                       metavar='Path',
+                       type=str,
+                       default=None,
+                       help='json file of the time of each phase and of the number of grew calls (also printed)')
+
+my_parser.add_argument('--profile',
+                       metavar='Phase',
+                       type=str,
+                       default=None,
+                       help='run this phase under cProfile (e.g. "combinations", "fisher"), its stats are printed and added to the trace')
+
 my_parser.add_argument('P1',
                        metavar='Pattern_P1',
                        type=str,
@@ -37,45 +86,14 @@ my_parser.add_argument('P3',
                        help='pattern P3')
 
 args = my_parser.parse_args()
+if args.update and args.state is None:
+    my_parser.error("--update needs --state")
+if args.state is not None and args.closed:
+    my_parser.error("--closed can't be used with --state")
+if args.state is not None and args.all and args.max_length is None:
+    # Every combination of the predictors of each match is kept in the state
+    my_parser.error("--state with -a needs --max-length")
 
-# ---------- Fonctions --------------------
-
-def conllu2dict(path : str) -> Dict:
-
-    with open (path, encoding="utf-8") as f:
-        conll = f.read().strip()
-        
-    trees = dict()
-    sentences = [x.split("\n") for x in conll.split("\n\n")]
-
-    for sent in sentences:
-        for line in sent:
-            if line.startswith("#"):
-                if "sent_id" in line:
-                    sent_id = line.split("=")[1].strip()
-                    trees[sent_id] = {}
-                    trees[sent_id]['0'] = ({"form" : "None"})
-            else:
-                token_id, form, lemma, upos, xpos, feats, head, deprel, deps, misc = line.split("\t")
-                if "-" not in token_id:
-                    trees[sent_id][token_id] = ({"form" : form, "lemma" : lemma, "upos" : upos, "deprel" : deprel})
-                    if feats != "_":
-                        features = [f.split("=") for f in feats.split("|")]
-                        dict_features = {lst[0]:lst[1] for lst in features}
-                        trees[sent_id][token_id].update(dict_features)
-    return trees
-
-def format_pattern(*pattern : str) -> str:
-    res = ";".join(pattern)
-    res = f"pattern {{ {res} }}"
-    return res
-
-def powerset(iterable):
-    "powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
-    s = list(iterable)
-    return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
-
-# ----------------------------------------
 
 # Args
 treebank_path = args.Treebank
@@ -85,87 +103,68 @@ P2 = args.P2
 P3 = args.P3
 
 
-# Get predictors in a dictionary
-predictors = defaultdict(list)
-
-# Boolean to handle querys with or without keys
-# For the moment the script doesn't accept mixed querys (with and without keys)
-
-is_key = False
+# Phase timings, with --trace or --profile
+trace = Trace(profile=args.profile) if args.trace or args.profile else NO_TRACE
 
-for s in P3.split(';'):
-    if re.search(r"^.+?\.\w+?$", s):
-        is_key = True
-        k, v = s.strip().split(".")
-        if v == "label":
-            re_match = re.search(fr"{k}:(\w+?)->(\w+?)", P1)
-            predictors[re_match.group(2)].append(["deprel", {"head" : re_match.group(1), "dep" : re_match.group(2)}])
-        else:
-            predictors[k].append(v)
-
-# Load corpus using Grew
+cache_dir = None if args.no_cache else DEFAULT_CACHE_DIR
 grew.init()
-treebank_idx = grew.corpus(treebank_path)
-
-# Load corpus in a dictionary
-treebank = conllu2dict(treebank_path)
+if treebank_path.endswith(".json"):
+    # Corpora json: the files are parsed in parallel and merged in one treebank
+    with trace.phase("corpus load"):
+        files, treebank = load_corpora(treebank_path, cache_dir=cache_dir)
+    with trace.phase("grew indexing"):
+        treebank_idx = grew.corpus(files)
+else:
+    # Load corpus using Grew
+    with trace.phase("grew indexing"):
+        treebank_idx = grew.corpus(treebank_path)
+    # Load corpus in a columnar treebank (mapped from the cache after the first run)
+    with trace.phase("corpus load"):
+        treebank = load_treebank(treebank_path, cache_dir=cache_dir)
 print("Corpus loaded!")
 
-# Get nodes matching P1
-matchs = grew.corpus_search(format_pattern(P1), treebank_idx)
-
-# Getting combinations of predictors depeding on the is_key boolean
-
-if is_key:
-    res = []
-    for m in matchs:
-        lst = []
-        for node, idx in m["matching"]["nodes"].items():
-            for var in predictors[node]:
-                # If it's a list is a deprel with a head and a dep
-                if isinstance(var, list):
-                    p = f"{var[1]['head']}-[{treebank[m['sent_id']][idx][var[0]]}]->{node}"
-                else:
-                    # Handling Node[Feature=Value]
-                    try:
-                        p = f"{node}[{var}={treebank[m['sent_id']][idx][var]}]"
-                    except KeyError:
-                        continue
-                lst.append(p)
-        # Handling option
-        if option:
-            # powerset
-            values = ["; ".join(v) for v in powerset(lst) if v]
-            for x in values:
-                res.append(x)
-        else:
-            # largest combinations
-            res.append("; ".join(lst))
-    patterns = Counter(res)
-# if is_key is False 
+# grew queries go through the cache (in memory, and on disk with --query-cache)
+queries = QueryCache(path=args.query_cache)
+queries.register(treebank_idx, treebank.fingerprint)
+
+if args.state is not None:
+    # Counts kept per sentence: with --update only the sentences of the treebank are searched and replaced
+    try:
+        state = CountState.load(args.state, P1, P2, P3, option, args.max_length) if args.update else CountState(P1, P2, P3, option, args.max_length)
+    except (OSError, ValueError) as e:
+        # State of another query or version, unreadable file
+        my_parser.error(str(e))
+    with trace.phase("contingency"):
+        changed = state.update(sentence_matches(treebank_idx, treebank, P1, P2, P3, trace.queries(queries)), treebank)
+        state.save(args.state)
+        M, n, counts = state.contingency(max(args.min_support, min_testable_support(state.n, state.M, ALPHA)))
+    print(f"{changed} sentences updated in {args.state}")
 else:
-    if option:
-        patterns = ["; ".join(p) for p in powerset([x.strip() for x in P3.split(";")]) if p]
-    else:
-        patterns = [P3]
+    # Contingency counts of every pattern from the P1 matches, P2 being evaluated on each match
+    with trace.phase("contingency"):
+        M, n, counts = build_contingency(treebank_idx, treebank, P1, P2, P3, option, quote=False, queries=queries,
+                                        min_support=args.min_support, max_length=args.max_length, alpha=ALPHA, closed=args.closed, trace=trace)
 
 print("Combinations? Done!")
 print("Significance calculation...")
 
-# Significance calculation
-M = grew.corpus_count(pattern = format_pattern(P1), corpus_index = treebank_idx)
-n = grew.corpus_count(pattern = format_pattern(P1, P2), corpus_index = treebank_idx)
-
-for pat in patterns:
-    # this is for handle the two possible : if it's a dict it has key patterns, on the contrary it has only simple patterns
-    if isinstance(patterns, dict):
-        N = patterns[pat]
-    else:
-        N = grew.corpus_count(pattern = format_pattern(P1, pat), corpus_index = treebank_idx)
-    k = grew.corpus_count(pattern = format_pattern(P1, P2, pat), corpus_index = treebank_idx)
-    table = np.array([[k, n-k], [N-k, M - (n + N) + k]])
-    oddsr, p_value = fisher_exact(table = table, alternative='greater')
-    if p_value < 0.01:
-        print(pat, p_value)
-
-toc = time.perf_counter()
+# Significance calculation, one vectorized Fisher test over all the patterns
+# Significant patterns are printed from the most significant one (-log10 p in log space)
+with trace.phase("fisher"):
+    patterns, stats = fisher_patterns(counts, n, M, alpha=ALPHA)
+    significant = np.flatnonzero(stats["pvalue"] < ALPHA)
+trace.count("patterns tested", len(patterns))
+with trace.phase("output"):
+    for i in significant[np.argsort(stats["log10_pvalue"][significant], kind="stable")]:
+        print(patterns[i], stats["pvalue"][i], round(float(stats["significance"][i]), 2), *counts[patterns[i]][2:])
+
+stats = queries.stats()
+print(f"Query cache: {stats['hits']} hits, {stats['misses']} misses")
+if trace is not NO_TRACE:
+    trace.count("query cache hits", stats["hits"])
+    trace.count("query cache misses", stats["misses"])
+    print(trace.summary())
+    if args.profile:
+        print(trace.profile_stats())
+    if args.trace:
+        trace.write(args.trace)
@@ -1,12 +1,13 @@
-
-from pathlib import Path
-from scipy.stats import fisher_exact
 import grew
-from typing import Dict
-import argparse, csv, re, subprocess
-from itertools import product, combinations
+import argparse, re
+from itertools import product
 import numpy as np
 
+from grew_session import GrewSession
+from pattern_mining import apriori
+from significance import ALPHA, fisher_patterns, min_testable_support, testable
+from profiling import NO_TRACE, Trace
+
 # -------------------------
 my_parser = argparse.ArgumentParser(description='Extraction of grammar rules from a treebank')
 
@@ -25,6 +26,18 @@ my_parser.add_argument('Corpora',
                        type=str,
                        help='corpora json')
 
+my_parser.add_argument('--trace',
+                       metavar='Path',
+                       type=str,
+                       default=None,
+                       help='json file of the time of each phase and of the number of grew calls (also printed)')
+
+my_parser.add_argument('--profile',
+                       metavar='Phase',
+                       type=str,
+                       default=None,
+                       help='run this phase under cProfile (e.g. "combinations"), its stats are printed and added to the trace')
+
 my_parser.add_argument('P1',
                        metavar='Pattern_P1',
                        type=str,
@@ -49,24 +62,12 @@ def format_pattern(*pattern : str) -> str:
     res = f"pattern {{ {res} }}"
     return res
 
-# Un problème : comment compiler le json de façon automatique
-def grew_count(*patterns , cluster : str, key_pattern : str, corpora) -> Dict[str, int]:
-
-    #subprocess.check_output(f"grew compile -i ../treebanks/{corpora}.json".split(), stderr=subprocess.STDOUT)
-
-    with open("tmp.pat","w", encoding="utf-8") as file: 
-        file.write(format_pattern(*patterns))
-    command = ['grew', 'count', '-pattern', 'tmp.pat', f'-{cluster}', key_pattern, '-i', corpora]
-    res_process = subprocess.run(command, capture_output=True, encoding='utf-8').stdout
-
-    # Erase file
-    tmp_file = Path("tmp.pat").resolve()
-    Path.unlink(tmp_file)
-    
-    for row in csv.DictReader(res_process.split("\n"), delimiter='\t'):
-        key_res = [k for k in row.keys() if k != 'Corpus']
-    return key_res
-
+def node_names(pattern : str) -> set:
+    "Node names used in grew clauses (edge names, features and relation labels left out)"
+    pattern = re.sub(r"\[[^\]]*\]", "", pattern)
+    pattern = re.sub(r"\b\w+\s*:", "", pattern)
+    pattern = re.sub(r"\.\w+", "", pattern)
+    return set(re.findall(r"[A-Za-z_]\w*", pattern))
 
 treebank_path = args.Treebank
 option = args.all
@@ -75,40 +76,84 @@ P1 = args.P1
 P2 = args.P2
 P3 = [s.strip() for s in args.P3.split(';')]
 
+# Phase timings, with --trace or --profile (grew calls go through trace.queries)
+trace = Trace(profile=args.profile) if args.trace or args.profile else NO_TRACE
+queries = trace.queries(grew)
+
+# One grew server for the session and the corpus index below
+grew.init()
+
+# One grew session for all the key queries: the corpora are loaded once
+with trace.phase("grew indexing"):
+    session = GrewSession(corpora)
+
 preds = []
+# Whether adding an item to a combination can only remove matches (key values, clauses on the nodes of P1)
+bounded = True
 
 # grew_count + key to get the values
-for pat in P3:
-    if ".label" in pat:
-        label = pat.split(".")[0]
-        m = re.search(fr"{label}:(\w+?)->(\w+?)", P1)
-        deprels = grew_count(P1, cluster="key", key_pattern = pat, corpora = corpora)
-        preds.append([f"{m.group(1)}-[{d}]->{m.group(2)}" for d in deprels])
-    elif ("." in pat and "=" not in pat):
-        node, feat = pat.split(".")
-        features = grew_count(P1, cluster="key", key_pattern = pat, corpora = corpora)
-        preds.append([f"{node}[{feat}={f}]" for f in features])
+with trace.phase("predictor values"):
+    for pat in P3:
+        if ".label" in pat:
+            label = pat.split(".")[0]
+            m = re.search(fr"{label}:(\w+?)->(\w+?)", P1)
+            trace.count("grew key count")
+            deprels = session.grew_count(P1, cluster="key", key_pattern = pat)
+            preds.append([f"{m.group(1)}-[{d}]->{m.group(2)}" for d in deprels])
+        elif ("." in pat and "=" not in pat):
+            node, feat = pat.split(".")
+            trace.count("grew key count")
+            features = session.grew_count(P1, cluster="key", key_pattern = pat)
+            preds.append([f"{node}[{feat}={f}]" for f in features])
+        else:
+            preds.append([pat])
+            # A clause with nodes outside P1 can multiply the matches: the supports of its supersets aren't bounded
+            if not node_names(pat) <= node_names(P1):
+                bounded = False
+
+with trace.phase("grew indexing"):
+    treebank_idx = grew.corpus(treebank_path)
+
+with trace.phase("count M, n"):
+    M = queries.corpus_count(pattern = format_pattern(P1), corpus_index = treebank_idx)
+    n = queries.corpus_count(pattern = format_pattern(P1, P2), corpus_index = treebank_idx)
+
+# Below this support no pattern can reach ALPHA, nor can its supersets (as long as they are bounded by it)
+min_support = min_testable_support(n, M, ALPHA)
+
+def support(c) -> int:
+    with trace.phase("count N"):
+        return queries.corpus_count(pattern = format_pattern(P1, *c), corpus_index = treebank_idx)
+
+with trace.phase("combinations"):
+    if option:
+        # All the possible combinations, level by level: the supersets of an untestable combination are not counted.
+        # With a clause adding nodes only the combinations without any match are left out (no superset can match)
+        supports = apriori(preds, support, min_support if bounded else 1)
     else:
-        preds.append([pat])
-
-if option:
-    # Get all possible combinations
-    patterns = [p for r in range(len(preds)) for c in combinations(preds, r + 1) for p in product(*c)]
-else:
-    # Get all the largest combinations
-    patterns = list(product(*preds))
-
-grew.init()
-treebank_idx = grew.corpus(treebank_path)
-
-M = grew.corpus_count(pattern = format_pattern(P1), corpus_index = treebank_idx)
-n = grew.corpus_count(pattern = format_pattern(P1, P2), corpus_index = treebank_idx)
-
-for c in patterns:
-    P3 = "; ".join(c)
-    N = grew.corpus_count(pattern = format_pattern(P1, P3), corpus_index = treebank_idx)
-    k = grew.corpus_count(pattern = format_pattern(P1, P2, P3), corpus_index = treebank_idx)
-    table = np.array([[k, n-k], [N-k, M - (n + N) + k]])
-    oddsr, p_value = fisher_exact(table = table, alternative='greater')
-    if p_value < 0.01:
-        print(P3, p_value)
+        # Get all the largest combinations
+        supports = {c : support(c) for c in product(*preds)}
+
+counts = {}
+for c, N in supports.items():
+    # k is only counted for the patterns that can be significant
+    if testable(N, n, M, ALPHA):
+        P3 = "; ".join(c)
+        with trace.phase("count k"):
+            k = queries.corpus_count(pattern = format_pattern(P1, P2, P3), corpus_index = treebank_idx)
+        counts[P3] = (k, N)
+trace.count("patterns tested", len(counts))
+
+# One vectorized Fisher test over all the patterns
+with trace.phase("fisher"):
+    patterns, stats = fisher_patterns(counts, n, M)
+with trace.phase("output"):
+    for i in np.flatnonzero(stats["pvalue"] < ALPHA):
+        print(patterns[i], stats["pvalue"][i])
+
+if trace is not NO_TRACE:
+    print(trace.summary())
+    if args.profile:
+        print(trace.profile_stats())
+    if args.trace:
+        trace.write(args.trace)
@@ -0,0 +1,75 @@
+import argparse, multiprocessing, os, shutil, tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from corpora import corpora_files
+from contingency import get_predictors
+from shards import count_candidates, count_shard, local_candidates, merge_counts, scaled_support, split_conllu
+from significance import ALPHA, fisher_patterns, min_testable_support
+
+# ---------- Extraction on a treebank split in shards ----------
+#
+# Same output as extraction_tool, for treebanks too large to be loaded in one
+# grew server: the conllu (or the files of a corpora json) is split into
+# shards of --shard-sentences sentences, counted by --processes workers with
+# their own grew server, and the counts are merged before the Fisher tests
+# (see shards.py). A worker process is replaced after each shard, so that its
+# grew server never holds more than one shard.
+
+def start_worker():
+    import grew
+    grew.init()
+
+def main():
+    parser = argparse.ArgumentParser(description='Extraction of grammar rules from a large treebank, split in shards counted in parallel')
+    parser.add_argument('Treebank', metavar='Path', type=str, help='the path to the conllu file or to a corpora json (all its files are loaded)')
+    parser.add_argument('-a', '--all', action='store_true', help='an optional argument')
+    parser.add_argument('--min-support', type=int, default=1, help='with -a, only the combinations occurring in at least this number of P1 matches are tested')
+    parser.add_argument('--max-length', type=int, default=None, help='with -a, maximum number of predictors in a combination')
+    parser.add_argument('--shard-sentences', type=int, default=10000, help='number of sentences of a shard')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--tmp', type=str, default=None, help='directory of the shards (default: the system temporary directory)')
+    parser.add_argument('P1', metavar='Pattern_P1', type=str, help='pattern P1')
+    parser.add_argument('P2', metavar='Pattern_P2', type=str, help='pattern P2')
+    parser.add_argument('P3', metavar='Pattern_P3', type=str, help='pattern P3')
+    args = parser.parse_args()
+
+    files = corpora_files(args.Treebank) if args.Treebank.endswith(".json") else [args.Treebank]
+    directory = tempfile.mkdtemp(prefix="extraction-shards-", dir=args.tmp)
+    try:
+        shards = split_conllu(files, args.shard_sentences, directory)
+        print(f"{len(shards)} shards")
+
+        # spawn + one task per worker: a new grew server for each shard
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(args.processes, len(shards)) or 1, mp_context=context, initializer=start_worker, max_tasks_per_child=1) as executor:
+            first = list(executor.map(count_shard, shards, [args.P1] * len(shards), [args.P2] * len(shards), [args.P3] * len(shards), [args.all] * len(shards)))
+        M = sum(M_shard for M_shard, _, _ in first)
+        n = sum(n_shard for _, n_shard, _ in first)
+        # Below this support no pattern can be significant
+        min_support = max(args.min_support, min_testable_support(n, M, ALPHA))
+
+        if args.all and get_predictors(args.P1, args.P3)[1]:
+            # The later passes only read the match tables, without grew
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                thresholds = [scaled_support(min_support, M_shard, M) for M_shard, _, _ in first]
+                local = list(executor.map(local_candidates, shards, thresholds, [args.max_length] * len(shards)))
+                candidates = set().union(*local)
+                missing = [sorted(candidates - set(found)) for found in local]
+                others = list(executor.map(count_candidates, shards, missing))
+            counts = merge_counts(local + others)
+            counts = {"; ".join(items) : tuple(kN) for items, kN in counts.items() if kN[1] >= min_support}
+        else:
+            counts = {pat : tuple(kN) for pat, kN in merge_counts(c for _, _, c in first).items() if kN[1] >= min_support}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(f"Combinations? Done! ({len(counts)} patterns, M = {M}, n = {n})")
+    print("Significance calculation...")
+
+    patterns, stats = fisher_patterns(counts, n, M, alpha=ALPHA)
+    significant = np.flatnonzero(stats["pvalue"] < ALPHA)
+    for i in significant[np.argsort(stats["log10_pvalue"][significant], kind="stable")]:
+        print(patterns[i], stats["pvalue"][i], round(float(stats["significance"][i]), 2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+import grew
+
+from contingency import format_pattern, match_key, match_names, project
+from corpora import load_corpora
+from treebank_cache import load_treebank
+
+# ---------- Persistent grew session ----------
+#
+# Replaces the "write tmp.pat + grew compile + grew count" subprocess calls:
+# the grew server started once by the caller (grew.init()) stays alive, the corpora are loaded
+# in it once, and the patterns are sent in memory. The -key and -whether
+# clusterings of "grew count" are computed from corpus_search, the key values
+# being read in the columnar treebank of the same files.
+
+class GrewSession:
+
+    def __init__(self, corpora : str, corpus_id : Optional[str] = None, queries = None):
+        """corpora is a corpora json (as for grew -i) or a single conllu file, queries an optional QueryCache.
+        The grew server must already be started (grew.init() by the caller): starting another one here
+        would make the indexes of the corpora the caller has loaded invalid"""
+        if corpora.endswith(".json"):
+            self.files, self.treebank = load_corpora(corpora, corpus_id)
+        else:
+            self.files, self.treebank = [corpora], load_treebank(corpora)
+        self.corpus_index = grew.corpus(self.files)
+        self.queries = grew
+        if queries is not None:
+            queries.register(self.corpus_index, self.treebank.fingerprint)
+            self.queries = queries
+
+    def count(self, *patterns : str) -> int:
+        return self.queries.corpus_count(pattern = format_pattern(*patterns), corpus_index = self.corpus_index)
+
+    def search(self, *patterns : str) -> List:
+        return self.queries.corpus_search(format_pattern(*patterns), self.corpus_index)
+
+    def key_value(self, m, key_pattern : str, patterns) -> Optional[str]:
+        "Value of key_pattern (X.feat or e.label) in the match m, None if undefined"
+        name, var = key_pattern.strip().split(".")
+        nodes = m["matching"]["nodes"]
+        if var == "label":
+            # e is declared as e:H->X, its label is the deprel of X
+            re_match = re.search(fr"{name}:\s*(\w+)\s*-[^>]*>\s*(\w+)", ";".join(patterns))
+            name, var = re_match.group(2), "deprel"
+        try:
+            return self.treebank.get(self.treebank.token_row(m["sent_id"], nodes[name]), var)
+        except KeyError:
+            return None
+
+    def grew_count(self, *patterns : str, cluster : str, key_pattern : str) -> Dict[str, int]:
+        "Same result as 'grew count -pattern patterns -{cluster} key_pattern'"
+        matchs = self.search(*patterns)
+        if cluster == "whether":
+            nodes, edges = match_names(matchs)
+            extended = project(self.search(*patterns, key_pattern), nodes, edges)
+            yes = sum(1 for m in matchs if extended[match_key(m, nodes, edges)])
+            return {"Yes" : yes, "No" : len(matchs) - yes}
+        elif cluster == "key":
+            values = Counter(self.key_value(m, key_pattern, patterns) for m in matchs)
+            values.pop(None, None)
+            return dict(values.most_common())
+        raise ValueError(f"Unknown clustering: {cluster}")
@@ -0,0 +1,116 @@
+import gzip, json, os
+from collections import defaultdict
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+import grew
+
+from contingency import get_items, get_predictors, outcome_weights
+
+# ---------- Incremental contingency counts ----------
+#
+# A CountState keeps, for one (P1, P2, P3) spec, the P1 matches of every
+# sentence (predictor items and number of P1&P2 extensions) with the totals
+# M, n and the (k, N) of every pattern. When sentences are added or
+# re-annotated, only these sentences are searched with grew: the
+# contributions stored for their sent_ids are subtracted, the new ones added,
+# and the Fisher tests run again on the updated counts. Since a rare pattern
+# can become frequent, all the patterns are kept (min_support and alpha only
+# apply when the counts are read): with option every combination of the
+# items of a match is kept, so a max_length is required. Only predictor specs
+# (X.feat; e.label) are supported: clause patterns are counted by grew on the
+# whole corpus.
+
+# Bumped when the layout of the state file changes
+STATE_VERSION = 1
+
+# P1 matches of a sentence: (predictor items, number of P1&P2 extensions)
+Matches = List[Tuple[Tuple[str, ...], int]]
+
+def sentence_matches(treebank_idx, treebank, P1 : str, P2 : str, P3 : str, queries = grew) -> Dict[str, Matches]:
+    "P1 matches of each sentence of the corpus having at least one"
+    predictors, any_key = get_predictors(P1, P3)
+    if not any_key:
+        raise ValueError("Incremental counts need a P3 of predictors (X.feat; e.label)")
+    matchs, _, _, weights, _, _ = outcome_weights(treebank_idx, P1, P2, queries)
+    res = defaultdict(list)
+    for m, w in zip(matchs, weights):
+        res[m["sent_id"]].append((tuple(item for _, item in get_items(m, treebank, predictors, quote=False)), w))
+    return dict(res)
+
+
+class CountState:
+
+    def __init__(self, P1 : str, P2 : str, P3 : str, option : bool, max_length : Optional[int] = None):
+        if option and max_length is None:
+            raise ValueError("Counting all the combinations needs a max_length (their number grows as 2^len(items))")
+        self.spec = {"P1" : P1, "P2" : P2, "P3" : P3, "option" : option, "max_length" : max_length}
+        self.sentences = {}
+        self.M = 0
+        self.n = 0
+        self.counts = defaultdict(lambda: [0, 0])
+
+    def patterns(self, items : Tuple[str, ...]) -> Iterable[Tuple[str, ...]]:
+        "Patterns counted for a match with these items"
+        if not self.spec["option"]:
+            # Largest combinations: the items of the match
+            return [items] if items else []
+        max_length = self.spec["max_length"] or len(items)
+        return (c for r in range(1, min(len(items), max_length) + 1) for c in combinations(items, r))
+
+    def add(self, matches : Matches, sign : int = 1):
+        for items, w in matches:
+            self.M += sign
+            self.n += sign * w
+            for pattern in self.patterns(items):
+                kN = self.counts[pattern]
+                kN[0] += sign * w
+                kN[1] += sign
+                if kN[1] == 0:
+                    del self.counts[pattern]
+
+    def update(self, sentences : Dict[str, Matches], sent_ids : Iterable[str] = ()) -> int:
+        """Replaces the matches of the sentences (new or changed ones, sent_ids being all the sentences searched,
+        with or without matches), returns the number of sentences whose counts changed"""
+        changed = 0
+        for sent_id in set(sent_ids) | set(sentences):
+            old, new = self.sentences.get(sent_id, []), sentences.get(sent_id, [])
+            if old == new:
+                continue
+            self.add(old, -1)
+            self.add(new)
+            if new:
+                self.sentences[sent_id] = new
+            else:
+                self.sentences.pop(sent_id, None)
+            changed += 1
+        return changed
+
+    def contingency(self, min_support : int = 1) -> Tuple[int, int, Dict[str, Tuple[int, int]]]:
+        "M, n and {pattern : (k, N)} like build_contingency"
+        return self.M, self.n, {"; ".join(pattern) : tuple(kN) for pattern, kN in self.counts.items() if kN[1] >= min_support}
+
+    def save(self, path : Union[str, Path]):
+        "Written atomically (gzipped json)"
+        state = {"version" : STATE_VERSION, "spec" : self.spec, "sentences" : self.sentences, "M" : self.M, "n" : self.n,
+                 "counts" : [[pattern, k, N] for pattern, (k, N) in self.counts.items()]}
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path : Union[str, Path], P1 : str, P2 : str, P3 : str, option : bool, max_length : Optional[int] = None) -> "CountState":
+        "State saved for this spec"
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+        res = cls(P1, P2, P3, option, max_length)
+        if state["version"] != STATE_VERSION:
+            raise ValueError(f"Unsupported state version in {path}")
+        if state["spec"] != res.spec:
+            raise ValueError(f"{path} holds the counts of another query: {state['spec']}")
+        res.sentences = {sent_id : [(tuple(items), w) for items, w in matches] for sent_id, matches in state["sentences"].items()}
+        res.M, res.n = state["M"], state["n"]
+        for pattern, k, N in state["counts"]:
+            res.counts[tuple(pattern)] = [k, N]
+        return res
@@ -0,0 +1,154 @@
+import atexit, hashlib, itertools, multiprocessing, os, shutil, tempfile, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# ---------- Background extraction jobs ----------
+#
+# The extractions run in a pool of worker processes instead of the Streamlit
+# script thread. Each worker starts its own grew server and keeps the corpora
+# it has loaded in a CorpusPool, whose parsed treebanks are bounded to
+# JOB_TREEBANK_MB (the grew server of the worker keeps all the indexes), so
+# successive jobs on the same upload don't load it again. Uploads are stored
+# once in a private directory of the queue, read by the workers, and removed
+# when no queued or running job needs them any more. Jobs are polled for their status
+# and their rows are retained (up to max_jobs finished jobs) to be displayed
+# again later.
+#
+# ProcessPoolExecutor reports a job as running as soon as it is moved to its
+# call queue, before a worker takes it: the job itself claims its start by
+# creating a file, so that a job which has not started yet can still be
+# cancelled (the canceller creates the file first and the worker skips it).
+
+# Number of worker processes
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", 2))
+
+# Memory kept by the parsed treebanks of each worker (MB)
+JOB_TREEBANK_MB = int(os.environ.get("JOB_TREEBANK_MB", 512))
+
+# Corpora loaded in the current worker process (a CorpusPool, created by the first job)
+loaded = None
+
+def start_worker():
+    import grew
+    grew.init()
+
+def claim(path : str) -> bool:
+    "Creates the claim file of a job, False if it was already claimed (started or cancelled)"
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+    return True
+
+def run_job(claim_path : str, path : str, filename : str, P1 : str, P2 : str, P3 : str, option : bool, dominant : bool, closed : bool) -> Optional[List]:
+    "Rows of iter_rules for one query, run in a worker process (None if the job was cancelled before it started)"
+    global loaded
+    import rules4streamlit as rules
+    if not claim(claim_path):
+        return None
+    if loaded is None:
+        loaded = rules.CorpusPool(JOB_TREEBANK_MB)
+    treebank_idx, treebank = loaded.get(Path(path).read_bytes(), filename)
+    res = []
+    for _, _, rows in rules.iter_rules(treebank_idx, treebank, P1, P2, P3, option, queries=rules.queries, dominant=dominant, closed=closed):
+        res.extend(rows)
+    return res
+
+
+class Job:
+
+    def __init__(self, job_id : int, corpus : str, query : Dict, future : Future, claim_path : str):
+        self.job_id = job_id
+        self.corpus = corpus
+        self.query = query
+        self.future = future
+        self.claim_path = claim_path
+        self.cancelled = False
+        self.submitted = time.time()
+
+    def status(self) -> str:
+        if self.future.cancelled() or self.cancelled:
+            return "cancelled"
+        if not self.future.done():
+            # Started once the worker has claimed it
+            return "running" if os.path.exists(self.claim_path) else "queued"
+        return "failed" if self.future.exception() is not None else "done"
+
+
+class JobQueue:
+
+    def __init__(self, workers : int = EXTRACTION_WORKERS, max_jobs : int = 100):
+        # spawn: the workers don't inherit the threads and the grew socket of the app
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=start_worker)
+        self.directory = tempfile.mkdtemp(prefix="extraction-jobs-")
+        # key -> (path, filename, number of add_corpus not followed by a submit yet)
+        self.corpora = {}
+        self.jobs = OrderedDict()
+        self.max_jobs = max_jobs
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def add_corpus(self, content : bytes, filename : str) -> str:
+        "Stores an upload for the workers, returns its key (content hash), to be passed to submit"
+        key = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            if key not in self.corpora:
+                path = os.path.join(self.directory, key + (Path(filename).suffix or ".conllu"))
+                with open(path, "wb") as f:
+                    f.write(content)
+                self.corpora[key] = [path, filename, 0]
+            self.corpora[key][2] += 1
+        return key
+
+    def submit(self, corpus : str, P1 : str, P2 : str, P3 : str, option : bool, dominant : bool = False, closed : bool = False) -> int:
+        "Queues an extraction on a corpus added with add_corpus, returns the job id"
+        query = {"P1" : P1, "P2" : P2, "P3" : P3, "option" : option, "dominant" : dominant, "closed" : closed}
+        with self.lock:
+            path, filename, _ = self.corpora[corpus]
+            self.corpora[corpus][2] -= 1
+            job_id = next(self.ids)
+            claim_path = os.path.join(self.directory, f"job-{job_id}.claim")
+            future = self.executor.submit(run_job, claim_path, path, filename, **query)
+            self.jobs[job_id] = Job(job_id, corpus, query, future, claim_path)
+            self.forget()
+        return job_id
+
+    def forget(self):
+        # The oldest finished jobs are dropped beyond max_jobs
+        finished = [job_id for job_id, job in self.jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            job = self.jobs.pop(job_id)
+            if os.path.exists(job.claim_path):
+                os.unlink(job.claim_path)
+        # Uploads no queued or running job needs (nor a pending submit)
+        needed = {job.corpus for job in self.jobs.values() if not job.future.done()}
+        for key in [key for key, (_, _, pending) in self.corpora.items() if key not in needed and pending <= 0]:
+            path, _, _ = self.corpora.pop(key)
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def status(self, job_id : int) -> str:
+        job = self.jobs.get(job_id)
+        return "unknown" if job is None else job.status()
+
+    def result(self, job_id : int, timeout : Optional[float] = None) -> List:
+        "Rows of the job (waits for it up to timeout, raises its exception if it failed)"
+        return self.jobs[job_id].future.result(timeout)
+
+    def cancel(self, job_id : int) -> bool:
+        "Cancels a job that hasn't started (a running one can't be stopped)"
+        job = self.jobs[job_id]
+        if job.future.cancel():
+            return True
+        # Already in the call queue of the executor: claimed before the worker, which then skips it
+        if claim(job.claim_path):
+            job.cancelled = True
+            return True
+        return False
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self.directory, ignore_errors=True)
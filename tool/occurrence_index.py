@@ -0,0 +1,193 @@
+from collections import defaultdict
+from itertools import combinations
+from typing import Dict, Generator, Hashable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+from pattern_mining import canonical_order
+
+# ---------- Bitset occurrence index of the P1 matches ----------
+#
+# Each predictor item (X[Number=Sing], X-[subj]->Y...) gets a packed bit array
+# over the table of the P1 matches, and so does the P2 outcome. N of a
+# combination is then the popcount of the AND of its items, k the popcount of
+# one more AND with the outcome. When a P1 match has several P1&P2 extensions
+# (weights > 1), k is the sum of the weights of the matches instead.
+# The -a mode walks the combinations depth first (Eclat), each extension being
+# one AND of the bits of the prefix; the largest combinations are counted
+# exactly, the matches having a value for another slot (node, feature) being
+# removed with the presence bits of that slot.
+# In closed mode, only the largest combination of each set of matches is
+# kept (the others have the same table and the same test); with a max_length,
+# a class whose largest combination is too long is kept through its shortest.
+# Both walks have a generator form (iter_eclat, iter_closed) so that a caller
+# can report progress, test the patterns while mining and stop the walk.
+
+# Number of 1 bits of every byte (numpy >= 2.0 has a bitwise_count ufunc)
+POPCOUNT = np.array([bin(b).count("1") for b in range(256)], dtype=np.uint8)
+
+def popcount(bits : np.ndarray) -> int:
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(bits).sum())
+    return int(POPCOUNT[bits].sum())
+
+
+class OccurrenceIndex:
+
+    def __init__(self, rows : Sequence[Sequence[Tuple[Hashable, Hashable]]], weights : Sequence[int]):
+        "rows are the (slot, item) pairs of each P1 match, weights its number of P1&P2 matches"
+        self.M = len(rows)
+        self.weights = np.asarray(weights, dtype=np.int64)
+        # Items in the order of the rows, as in the patterns of fp_growth
+        self.rank = canonical_order(([item for _, item in row], 0) for row in rows)
+
+        positions, slots, self.slot = defaultdict(list), defaultdict(list), {}
+        for i, row in enumerate(rows):
+            for slot, item in row:
+                positions[item].append(i)
+                slots[slot].append(i)
+                self.slot[item] = slot
+        self.items = {item : self.pack(pos) for item, pos in positions.items()}
+        self.presence = {slot : self.pack(pos) for slot, pos in slots.items()}
+        self.outcome = self.pack(np.flatnonzero(self.weights > 0))
+        # k is a popcount as long as a match has at most one P1&P2 extension
+        self.binary = bool((self.weights <= 1).all())
+
+    def pack(self, positions) -> np.ndarray:
+        bits = np.zeros(self.M, dtype=bool)
+        bits[positions] = True
+        return np.packbits(bits)
+
+    def k(self, bits : np.ndarray) -> int:
+        if self.binary:
+            return popcount(bits & self.outcome)
+        return int(self.weights[np.unpackbits(bits, count=self.M).astype(bool)].sum())
+
+    def bits(self, items : Sequence[Hashable]) -> np.ndarray:
+        "Matches having all the items"
+        bits = self.items[items[0]]
+        for item in items[1:]:
+            bits = bits & self.items[item]
+        return bits
+
+    def support(self, items : Sequence[Hashable]) -> List[int]:
+        "[k, N] of the matches having all the items"
+        bits = self.bits(items)
+        return [self.k(bits), popcount(bits)]
+
+    def exact(self, items : Sequence[Hashable]) -> List[int]:
+        "[k, N] of the matches whose items are exactly these ones"
+        bits = self.bits(items)
+        used = {self.slot[item] for item in items}
+        for slot, presence in self.presence.items():
+            if slot not in used:
+                bits = bits & ~presence
+        return [self.k(bits), popcount(bits)]
+
+    def eclat(self, min_support : int = 1, max_length : Optional[int] = None) -> Dict[Tuple[Hashable, ...], List[int]]:
+        "{pattern : [k, N]} for the combinations of support N >= min_support, same result as fp_growth"
+        return dict(self.iter_eclat(min_support, max_length))
+
+    def iter_eclat(self, min_support : int = 1, max_length : Optional[int] = None) -> Iterator[Tuple[Tuple[Hashable, ...], List[int]]]:
+        "(pattern, [k, N]) of eclat, yielded as they are found (stopping the iteration stops the walk)"
+        min_support = max(min_support, 1)
+
+        def extend(prefix : Tuple[Hashable, ...], candidates : List[Tuple[Hashable, np.ndarray, int]]):
+            for j, (item, bits, N) in enumerate(candidates):
+                pattern = prefix + (item,)
+                yield pattern, [self.k(bits), N]
+                if max_length is not None and len(pattern) >= max_length:
+                    continue
+                # Items of the same slot never occur together: their AND is empty and pruned
+                extensions = []
+                for other, other_bits, _ in candidates[j + 1:]:
+                    both = bits & other_bits
+                    both_N = popcount(both)
+                    if both_N >= min_support:
+                        extensions.append((other, both, both_N))
+                if extensions:
+                    yield from extend(pattern, extensions)
+
+        singles = [(item, self.items[item], popcount(self.items[item])) for item in sorted(self.items, key=self.rank.get)]
+        if max_length is None or max_length > 0:
+            yield from extend((), [c for c in singles if c[2] >= min_support])
+
+    def closed(self, min_support : int = 1, max_length : Optional[int] = None) -> Dict[Tuple[Hashable, ...], List[int]]:
+        """{pattern : [k, N, size]} for the closed combinations of support N >= min_support:
+        the largest combination of each set of matches, size being the number of combinations having exactly these matches.
+        With max_length, a class whose largest combination is longer is given by its shortest one (if short enough),
+        and size only counts the combinations of at most max_length items"""
+        walk = self.iter_closed(min_support, max_length)
+        while True:
+            try:
+                next(walk)
+            except StopIteration as stop:
+                return stop.value
+
+    def iter_closed(self, min_support : int = 1, max_length : Optional[int] = None) -> Generator[Tuple[int, int], None, Dict[Tuple[Hashable, ...], List[int]]]:
+        """closed, yielding (done, total) after the combinations of each single item and returning its result
+        (a class is only known once the walk is over, stopping the iteration stops the walk)"""
+        min_support = max(min_support, 1)
+        # Set of matches -> largest combination found for it
+        classes = {}
+
+        def extend(pattern : Tuple[Hashable, ...], bits : np.ndarray, N : int, candidates : List[Tuple[Hashable, np.ndarray, int]]):
+            # Items present in all the matches of the pattern are absorbed instead of being branched on
+            pattern += tuple(item for item, _, other_N in candidates if other_N == N)
+            candidates = [c for c in candidates if c[2] < N]
+            key = bits.tobytes()
+            if key not in classes or len(classes[key][0]) < len(pattern):
+                classes[key] = (pattern, bits, N)
+            for j, (item, item_bits, item_N) in enumerate(candidates):
+                extensions = []
+                for other, other_bits, _ in candidates[j + 1:]:
+                    both = item_bits & other_bits
+                    both_N = popcount(both)
+                    if both_N >= min_support:
+                        extensions.append((other, both, both_N))
+                extend(pattern + (item,), item_bits, item_N, extensions)
+
+        singles = [(item, self.items[item], popcount(self.items[item])) for item in sorted(self.items, key=self.rank.get)]
+        singles = [c for c in singles if c[2] >= min_support]
+        for j, (item, bits, N) in enumerate(singles):
+            extensions = [(other, bits & other_bits, popcount(bits & other_bits)) for other, other_bits, _ in singles[j + 1:]]
+            extend((item,), bits, N, [c for c in extensions if c[2] >= min_support])
+            yield j + 1, len(singles)
+
+        res = {}
+        for pattern, bits, N in classes.values():
+            shown = pattern
+            if max_length is not None and len(pattern) > max_length:
+                # The class is kept through its shortest combination, if one is short enough
+                shown = self.shortest_generator(pattern, bits, max_length)
+                if shown is None:
+                    continue
+            res[tuple(sorted(shown, key=self.rank.get))] = [self.k(bits), N, self.class_size(pattern, bits, max_length)]
+        return res
+
+    def split_items(self, pattern : Tuple[Hashable, ...], bits : np.ndarray) -> Tuple[List[Hashable], List[Hashable]]:
+        "Essential items of a closed pattern (in every combination having its matches) and the optional ones"
+        # Without an essential item the matches are different: only the others are left out or not
+        essential = [item for item in pattern if not np.array_equal(self.bits([x for x in pattern if x != item]), bits)]
+        return essential, [item for item in pattern if item not in essential]
+
+    def shortest_generator(self, pattern : Tuple[Hashable, ...], bits : np.ndarray, max_length : int) -> Optional[Tuple[Hashable, ...]]:
+        "Shortest combination having the matches of the closed pattern, None if it has more than max_length items"
+        essential, optional = self.split_items(pattern, bits)
+        for r in range(max_length - len(essential) + 1):
+            for extra in combinations(optional, r):
+                items = tuple(essential) + extra
+                if items and np.array_equal(self.bits(items), bits):
+                    return items
+        return None
+
+    def class_size(self, pattern : Tuple[Hashable, ...], bits : np.ndarray, max_length : Optional[int] = None) -> int:
+        "Number of combinations (of at most max_length items) having the matches of the closed pattern"
+        if len(pattern) == 1:
+            return 1
+        essential, optional = self.split_items(pattern, bits)
+        size = 0
+        for mask in range(2 ** len(optional)):
+            items = essential + [item for i, item in enumerate(optional) if mask >> i & 1]
+            if items and (max_length is None or len(items) <= max_length) and np.array_equal(self.bits(items), bits):
+                size += 1
+        return size
@@ -0,0 +1,67 @@
+from typing import Hashable, List, Optional, Sequence
+
+# ---------- Most significant sub/super-patterns ----------
+#
+# A significant pattern is kept only if it is more significant than every
+# significant pattern made of a part of its items: lower p-value, or same
+# p-value and higher probability ratio. This is the filter of the extraction
+# scripts, which compared every pattern with every other one; here the
+# patterns are stored in a trie over their sorted items, and each pattern
+# only walks the branches made of its own items, i.e. its real sub-patterns.
+
+class TrieNode:
+
+    __slots__ = ("children", "indices")
+
+    def __init__(self):
+        self.children = {}
+        self.indices = []
+
+
+class PatternTrie:
+
+    def __init__(self):
+        "Patterns stored by their sorted item numbers"
+        self.root = TrieNode()
+        self.numbers = {}
+
+    def key(self, pattern : Sequence[Hashable]) -> tuple:
+        return tuple(sorted({self.numbers.setdefault(item, len(self.numbers)) for item in pattern}))
+
+    def add(self, key : tuple, index : int):
+        node = self.root
+        for item in key:
+            node = node.children.setdefault(item, TrieNode())
+        node.indices.append(index)
+
+    def sub_patterns(self, key : tuple, node : Optional[TrieNode] = None, start : int = 0):
+        "Indices of the patterns made of items of key"
+        node = self.root if node is None else node
+        for j in range(start, len(key)):
+            child = node.children.get(key[j])
+            if child is not None:
+                yield from child.indices
+                yield from self.sub_patterns(key, child, j + 1)
+
+
+def beats(pvalue : float, ratio : float, sub_pvalue : float, sub_ratio : float) -> bool:
+    "A pattern beats its sub-pattern if it is more significant (a NaN ratio never wins a tie)"
+    return pvalue < sub_pvalue or (pvalue == sub_pvalue and ratio > sub_ratio)
+
+
+def dominates(i : int, key : tuple, trie : PatternTrie, pvalues : Sequence[float], ratios : Sequence[float]) -> bool:
+    "The pattern i beats all the patterns of the trie made of its items"
+    # A NaN ratio isn't equal to itself: such a pattern never survives (as in the scripts)
+    if ratios[i] != ratios[i]:
+        return False
+    return all(j == i or beats(pvalues[i], ratios[i], pvalues[j], ratios[j]) for j in trie.sub_patterns(key))
+
+
+def dominant_patterns(patterns : Sequence[Sequence[Hashable]], pvalues : Sequence[float], ratios : Sequence[float]) -> List[int]:
+    """Indices of the patterns (lists of items) that beat all their sub-patterns.
+    pvalues can be p-values or log10 p-values, ratios are the probability ratios"""
+    trie = PatternTrie()
+    keys = [trie.key(pat) for pat in patterns]
+    for i, key in enumerate(keys):
+        trie.add(key, i)
+    return [i for i, key in enumerate(keys) if dominates(i, key, trie, pvalues, ratios)]
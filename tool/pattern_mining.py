@@ -0,0 +1,158 @@
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+# ---------- Frequent pattern mining (FP-growth) ----------
+#
+# The -a/--all mode counts every combination of the predictors of each match,
+# i.e. 2^d patterns per match. Here the matches are transactions (their list
+# of predictor items + the P2 outcome weight) compressed in an FP-tree, and
+# only the combinations whose support N reaches min_support (and of at most
+# max_length items) are generated. With min_support=1 and no max_length the
+# result is the same as counting the powerset of every transaction.
+#
+# Each pattern gets [k, N]: N the number of transactions containing it and k
+# the sum of their weights (the number of P1&P2 matches).
+
+Item = Hashable
+Transaction = Tuple[Sequence[Item], int]
+
+
+def canonical_order(transactions : Iterable[Transaction]) -> Dict[Item, int]:
+    "Rank of the items consistent with the order of the items in every transaction"
+    # Items are ordered by their slot (node, feature...) in all the transactions:
+    # a topological sort of "a comes before b" gives back that global order
+    successors, indegree, first_seen = defaultdict(set), defaultdict(int), {}
+    for items, _ in transactions:
+        for item in items:
+            first_seen.setdefault(item, len(first_seen))
+        for a, b in zip(items, items[1:]):
+            if b not in successors[a]:
+                successors[a].add(b)
+                indegree[b] += 1
+
+    ready = sorted((item for item in first_seen if indegree[item] == 0), key=first_seen.get)
+    rank = {}
+    while ready:
+        item = ready.pop(0)
+        rank[item] = len(rank)
+        for b in sorted(successors[item], key=first_seen.get):
+            indegree[b] -= 1
+            if indegree[b] == 0:
+                ready.append(b)
+        ready.sort(key=first_seen.get)
+    # Inconsistent orders (cycles): remaining items by first appearance
+    for item in sorted(first_seen, key=first_seen.get):
+        rank.setdefault(item, len(rank))
+    return rank
+
+
+class FPNode:
+
+    __slots__ = ("item", "count", "weight", "parent", "children")
+
+    def __init__(self, item : Optional[Item], parent : Optional["FPNode"]):
+        self.item = item
+        self.count = 0
+        self.weight = 0
+        self.parent = parent
+        self.children = {}
+
+
+def build_tree(paths : Iterable[Tuple[List[Item], int, int]], min_support : int, rank : Dict[Item, int]) -> Tuple[Dict[Item, List[FPNode]], Dict[Item, List[int]]]:
+    "FP-tree of (items, count, weight) paths, returns the header table and the [k, N] of the frequent items"
+    paths = list(paths)
+    supports = defaultdict(lambda: [0, 0])
+    for items, count, weight in paths:
+        for item in items:
+            supports[item][0] += weight
+            supports[item][1] += count
+    frequent = {item : kN for item, kN in supports.items() if kN[1] >= min_support}
+
+    root = FPNode(None, None)
+    header = defaultdict(list)
+    for items, count, weight in paths:
+        # Most frequent items first, so that the paths share their prefixes
+        items = sorted((item for item in items if item in frequent), key=lambda item: (-frequent[item][1], rank[item]))
+        node = root
+        for item in items:
+            child = node.children.get(item)
+            if child is None:
+                child = node.children[item] = FPNode(item, node)
+                header[item].append(child)
+            child.count += count
+            child.weight += weight
+            node = child
+    return header, frequent
+
+
+def mine_tree(header, frequent, suffix : Tuple[Item, ...], min_support : int, max_length : Optional[int], rank : Dict[Item, int], res : Dict[Tuple[Item, ...], List[int]]):
+    # Least frequent items first (bottom of the tree)
+    for item in sorted(frequent, key=lambda item: (frequent[item][1], -rank[item])):
+        pattern = suffix + (item,)
+        res[tuple(sorted(pattern, key=rank.get))] = list(frequent[item])
+        if max_length is not None and len(pattern) >= max_length:
+            continue
+        # Conditional pattern base: the prefix paths of the nodes of item
+        paths = []
+        for node in header[item]:
+            path = []
+            parent = node.parent
+            while parent.item is not None:
+                path.append(parent.item)
+                parent = parent.parent
+            if path:
+                paths.append((path, node.count, node.weight))
+        if paths:
+            sub_header, sub_frequent = build_tree(paths, min_support, rank)
+            if sub_frequent:
+                mine_tree(sub_header, sub_frequent, pattern, min_support, max_length, rank, res)
+
+
+def fp_growth(transactions : Iterable[Transaction], min_support : int = 1, max_length : Optional[int] = None) -> Dict[Tuple[Item, ...], List[int]]:
+    "{pattern : [k, N]} for the patterns of support N >= min_support, items in the order of the transactions"
+    transactions = [(list(items), weight) for items, weight in transactions]
+    rank = canonical_order(transactions)
+    header, frequent = build_tree(((items, 1, weight) for items, weight in transactions), min_support, rank)
+    res = {}
+    if max_length is None or max_length > 0:
+        mine_tree(header, frequent, (), min_support, max_length, rank, res)
+    return res
+
+
+# ---------- Level-wise search (Apriori) ----------
+#
+# When the support of a pattern is a query (grew count) and not a scan of the
+# transactions, the combinations are explored by increasing length: a
+# combination is only counted if all its sub-combinations reached
+# min_support, since adding items can only lower the support.
+
+def apriori(slots : Sequence[Sequence[Item]], support : Callable[[Tuple[Item, ...]], int], min_support : int = 1, max_length : Optional[int] = None) -> Dict[Tuple[Item, ...], int]:
+    "{pattern : N} for the patterns of support N >= min_support taking at most one item of each slot"
+    res = {}
+    level = {}
+    for s, items in enumerate(slots):
+        for item in items:
+            N = support((item,))
+            if N >= min_support:
+                level[((s, item),)] = N
+    length = 1
+    while level:
+        res.update({tuple(item for _, item in c) : N for c, N in level.items()})
+        if max_length is not None and length >= max_length:
+            break
+        length += 1
+        candidates = {}
+        for c in level:
+            last = c[-1][0]
+            for s in range(last + 1, len(slots)):
+                for item in slots[s]:
+                    candidate = c + ((s, item),)
+                    # Every sub-combination must be frequent
+                    if all(candidate[:i] + candidate[i + 1:] in level for i in range(len(candidate) - 1)):
+                        candidates[candidate] = None
+        level = {}
+        for c in candidates:
+            N = support(tuple(item for _, item in c))
+            if N >= min_support:
+                level[c] = N
+    return res
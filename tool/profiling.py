@@ -0,0 +1,135 @@
+import cProfile, io, json, pstats, time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Optional, Union
+import grew
+
+from query_cache import QueryCache
+
+# ---------- Phase timings of an extraction ----------
+#
+# A Trace times the phases of a run (corpus load, grew indexing, P1 search,
+# predictor extraction, combinations, grew counts, Fisher tests, output).
+# Phases nest: a phase is recorded under the path of the phases around it
+# ("contingency/P1 search/grew corpus_search"), with its total time, its own
+# time (without the phases inside it) and its number of calls, so a slow run
+# shows whether it is spent in grew, in the combinations or in the tests.
+# Grew calls are counted and timed by passing trace.queries(grew) instead of
+# grew. With trace.queries(QueryCache), the lookups are counted as "query
+# corpus_search/count" and only the misses, which call grew, as "grew
+# corpus_search/count". One phase can be run under cProfile. The
+# functions take trace=None by default and then use NO_TRACE, which does
+# nothing.
+
+class Trace:
+
+    def __init__(self, profile : Optional[str] = None):
+        "profile: name of the phase to run under cProfile"
+        self.phases = {}
+        self.counters = Counter()
+        self.stack = []
+        self.profile_phase = profile
+        self.profiler = cProfile.Profile() if profile else None
+        self.profiling = False
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name : str):
+        path = "/".join([p for p, _ in self.stack] + [name])
+        # Time spent in the phases inside this one
+        self.stack.append((name, [0.0]))
+        profile = self.profiler is not None and name == self.profile_phase and not self.profiling
+        if profile:
+            self.profiling = True
+            self.profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile:
+                self.profiler.disable()
+                self.profiling = False
+            _, inner = self.stack.pop()
+            if self.stack:
+                self.stack[-1][1][0] += elapsed
+            record = self.phases.setdefault(path, {"wall_s" : 0.0, "self_s" : 0.0, "calls" : 0})
+            record["wall_s"] += elapsed
+            record["self_s"] += elapsed - inner[0]
+            record["calls"] += 1
+
+    def count(self, name : str, n : int = 1):
+        self.counters[name] += n
+
+    def queries(self, queries) -> "TracedQueries":
+        return TracedQueries(queries, self)
+
+    def profile_stats(self, limit : int = 30) -> Optional[str]:
+        "Functions of the profiled phase by cumulative time"
+        if self.profiler is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def report(self) -> Dict:
+        return {
+            "total_s" : time.perf_counter() - self.start,
+            "phases" : self.phases,
+            "counters" : dict(self.counters),
+            "profile" : {"phase" : self.profile_phase, "stats" : self.profile_stats()} if self.profiler is not None else None,
+        }
+
+    def write(self, path : Union[str, Path]):
+        "JSON trace of the run"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def summary(self) -> str:
+        "One line per phase and per counter"
+        lines = [f"{path:60} {r['wall_s']:9.3f}s {r['self_s']:9.3f}s self {r['calls']:8} calls" for path, r in self.phases.items()]
+        lines += [f"{name:60} {value}" for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+
+class NullTrace(Trace):
+
+    def phase(self, name : str):
+        return nullcontext()
+
+    def count(self, name : str, n : int = 1):
+        pass
+
+    def queries(self, queries):
+        return queries
+
+NO_TRACE = NullTrace()
+
+
+class TracedQueries:
+
+    def __init__(self, queries, trace : Trace):
+        "grew (or a QueryCache) with its calls counted and timed in the trace"
+        self.queries = queries
+        self.trace = trace
+        # A cache calls the traced grew on its misses
+        self.backend = TracedQueries(grew, trace) if isinstance(queries, QueryCache) else None
+        self.name = "query" if self.backend is not None else "grew"
+
+    def call(self, kind : str, pattern, corpus_index, *args, **kwargs):
+        name = f"{self.name} {kind}"
+        self.trace.count(name)
+        if self.backend is not None:
+            kwargs["backend"] = self.backend
+        with self.trace.phase(name):
+            return getattr(self.queries, kind)(pattern, corpus_index, *args, **kwargs)
+
+    def corpus_search(self, pattern, corpus_index, *args, **kwargs):
+        return self.call("corpus_search", pattern, corpus_index, *args, **kwargs)
+
+    def corpus_count(self, pattern, corpus_index, *args, **kwargs):
+        return self.call("corpus_count", pattern, corpus_index, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.queries, name)
@@ -0,0 +1,119 @@
+import json, re, sqlite3, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import grew
+
+# ---------- Cache of grew queries ----------
+#
+# QueryCache has the corpus_count/corpus_search interface of the grew module
+# and can be passed instead of it (queries=...) to build_contingency,
+# rules_extraction and GrewSession.
+# Results are keyed by (corpus fingerprint, canonical pattern): the
+# fingerprint is the content hash of the treebank registered for the corpus
+# index, so a result stays valid when the same corpus is loaded again (new
+# grew index, new process). The in-memory part is an LRU bounded to maxsize
+# entries; with a path, results are also stored in a sqlite file that
+# survives restarts. Corpora without a fingerprint are only cached in memory.
+
+# Bumped when canonical_pattern changes: the keys of a sqlite file written before aren't used
+KEY_VERSION = 2
+
+# A quoted value (with its escaped characters), text without quotes, a clause
+QUOTED = r'"(?:[^"\\]|\\.)*"'
+QUOTED_OR_NOT = rf'(?:{QUOTED}|[^"])*'
+CLAUSE = rf'(?:{QUOTED}|[^;\n"])+'
+
+def canonical_pattern(pattern : str) -> str:
+    "pattern { A; B } -> clauses with normalized spaces, in sorted order (the order of clauses doesn't matter to grew)"
+    body = pattern.strip()
+    re_match = re.fullmatch(r"pattern\s*\{(.*)\}", body, flags=re.DOTALL)
+    if re_match is None or "{" in re_match.group(1) or "}" in re_match.group(1) or re.fullmatch(QUOTED_OR_NOT, re_match.group(1)) is None:
+        # Not a single pattern block (e.g. with a without), or an unclosed quote: only spaces are normalized
+        return normalize_spaces(body)
+    # Clauses are separated by ; or newlines outside the quoted values (X[form=";"])
+    clauses = [normalize_spaces(c) for c in re.findall(CLAUSE, re_match.group(1))]
+    return "pattern { " + "; ".join(sorted(c for c in clauses if c)) + " }"
+
+def normalize_spaces(text : str) -> str:
+    # Runs of spaces are collapsed, except inside quoted values
+    parts = re.split(f"({QUOTED})", text.strip())
+    return "".join(p if p.startswith('"') else re.sub(r"\s+", " ", p) for p in parts)
+
+
+class QueryCache:
+
+    def __init__(self, maxsize : int = 4096, path : Optional[Union[str, Path]] = None):
+        self.maxsize = maxsize
+        self.memory = OrderedDict()
+        self.fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(str(path), check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS queries (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.commit()
+
+    def register(self, corpus_index : int, fingerprint : Optional[str]):
+        "Declare the content hash of the corpus loaded under corpus_index"
+        with self.lock:
+            self.fingerprints[corpus_index] = fingerprint
+
+    def _get(self, key : str, persistent : bool):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return True, self.memory[key]
+            if persistent and self.db is not None:
+                row = self.db.execute("SELECT value FROM queries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    return True, value
+            self.misses += 1
+            return False, None
+
+    def _put(self, key : str, value, persistent : bool):
+        with self.lock:
+            self._remember(key, value)
+            if persistent and self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO queries VALUES (?, ?)", (key, json.dumps(value)))
+                self.db.commit()
+
+    def _remember(self, key : str, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+
+    def _query(self, kind : str, pattern : str, corpus_index : int, run):
+        fingerprint = self.fingerprints.get(corpus_index)
+        persistent = fingerprint is not None
+        key = "\t".join([f"v{KEY_VERSION}", fingerprint if persistent else f"index:{corpus_index}", kind, canonical_pattern(pattern)])
+        found, value = self._get(key, persistent)
+        if not found:
+            value = run(pattern, corpus_index)
+            self._put(key, value, persistent)
+        return value
+
+    # grew interface (backend: what is called on a miss, grew or a traced grew)
+
+    def corpus_count(self, pattern : str, corpus_index : int, backend = grew) -> int:
+        return self._query("count", pattern, corpus_index, backend.corpus_count)
+
+    def corpus_search(self, pattern : str, corpus_index : int, backend = grew) -> List:
+        return self._query("search", pattern, corpus_index, backend.corpus_search)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits" : self.hits, "misses" : self.misses, "entries" : len(self.memory)}
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.db is not None:
+                self.db.execute("DELETE FROM queries")
+                self.db.commit()
@@ -1,164 +1,180 @@
-import re
-from collections import defaultdict, Counter
-from itertools import combinations, chain
-from typing import Dict, Tuple
-from scipy.stats import fisher_exact
+import hashlib, io, os, tempfile, threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Tuple
 import numpy as np
 import grew
 from pathlib import Path
 import pandas as pd
 
-# ---------- Fonctions ----------
+from treebank_store import Treebank
+from contingency import iter_contingency
+from query_cache import QueryCache
+from pattern_filter import PatternTrie, dominates
+from significance import ALPHA, fisher_batch, testable
+from profiling import NO_TRACE
+
+# Query cache shared by all the sessions of the app
+queries = QueryCache()
 
-def load_corpus(content : str, filename : str) -> Tuple[int, Dict]:
+# Memory kept by the parsed treebanks of the pool of loaded corpora (MB). It doesn't bound
+# the grew server: grew has no request to unload a corpus, so it keeps the index of every
+# corpus loaded (evicted ones included) until the app is restarted
+TREEBANK_CACHE_MB = int(os.environ.get("TREEBANK_CACHE_MB", 1024))
 
-    # Load corpus using Grew
-    with open (filename, "wb") as f:
-        f.write(content)
+# ---------- Fonctions ----------
 
-    treebank_idx = grew.corpus(filename)
-    # Load corpus in a dictionary
-    treebank = conllu2dict(filename)
+def load_corpus(content : bytes, filename : str, fingerprint : Optional[str] = None) -> Tuple[int, Treebank]:
+    "grew index and columnar treebank of an uploaded conllu, filename being only used as the suffix of the grew file"
 
-    # Erase file
-    f = Path(filename).resolve()
-    Path.unlink(f)
+    # Load corpus using Grew, from a private file of this call (mode 0600, unique name)
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=Path(filename).suffix or ".conllu")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        treebank_idx = grew.corpus(path)
+    finally:
+        os.unlink(path)
+
+    # Load corpus in a columnar treebank, parsed from the uploaded bytes (BytesIO shares the buffer)
+    with io.TextIOWrapper(io.BytesIO(content), encoding="utf-8") as f:
+        treebank = Treebank.from_file(f)
+    treebank.fingerprint = fingerprint or hashlib.sha1(content).hexdigest()
+    queries.register(treebank_idx, treebank.fingerprint)
 
     return treebank_idx, treebank
 
 
-def conllu2dict(path : str) -> Dict:
-
-    with open (path) as f:
-        conll = f.read().strip()
-
-    trees = dict()
-    sentences = [x.split("\n") for x in conll.split("\n\n")]
-
-    for sent in sentences:
-        for line in sent:
-            if line.startswith("#"):
-                if "sent_id" in line:
-                    sent_id = line.split("=")[1].strip()
-                    trees[sent_id] = {}
-                    trees[sent_id]['0'] = ({"form" : "None"})
-            else:
-                token_id, form, lemma, upos, xpos, feats, head, deprel, deps, misc = line.split("\t")
-                if "-" not in token_id:
-                    trees[sent_id][token_id] = ({"form" : form, "lemma" : lemma, "upos" : upos, "deprel" : deprel})
-                    if feats != "_":
-                        features = [f.split("=") for f in feats.split("|")]
-                        dict_features = {lst[0]:lst[1] for lst in features}
-                        trees[sent_id][token_id].update(dict_features)
-    return trees
-
-def format_pattern(*pattern : str) -> str:
-    res = ";".join(pattern)
-    res = f"pattern {{ {res} }}"
-    return res
-
-def format_significance(p_value : float) -> int:
-    if "-" in str(p_value):
-        significance = str(p_value).split("-")[1]
-        significance = int(re.sub(r"^0", "", significance))
-    elif p_value == 0:
-        significance = np.inf
-    else:
-        significance = int(re.search(r"\.(0+)", str(p_value)).group(1).count("0"))
-    return significance 
-
-def powerset(iterable):
-    "powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
-    s = list(iterable)
-    return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
-
-def get_predictors(P1, P3):
-    # Get predictors in a dictionary
-    any_key = False
-    predictors = defaultdict(list)
-
-    # Boolean to handle querys with or without keys
-    # For the moment the script doesn't accept mixed querys (with and without keys)
-
-    for s in P3.split(';'):
-        if re.search(r'^.+?\.\w+?$', s):
-            any_key = True
-            k, v = s.strip().split(".")
-            if v == "label":
-                re_match = re.search(fr"{k}:(\w+?)->(\w+?)", P1)
-                predictors[re_match.group(2)].append(["deprel", {"head" : re_match.group(1), "dep" : re_match.group(2)}])
-            else:
-                predictors[k].append(v)
-    return predictors, any_key  
-
-def get_patterns2query(treebank_idx, treebank, P1, P3, option):
-
-    predictors, any_key = get_predictors(P1, P3)
-
-    # Get nodes matching P1
-    matchs = grew.corpus_search(format_pattern(P1), treebank_idx)
-
-    # Getting combinations of predictors depeding on the any_key boolean
-    if any_key:
-        res = []
-        for m in matchs:
-            lst = []
-            for node, idx in m["matching"]["nodes"].items():
-                for var in predictors[node]:
-                    # If it's a list is a deprel with a head and a dep
-                    if isinstance(var, list):
-                        p = f'{var[1]["head"]}-[{treebank[m["sent_id"]][idx][var[0]]}]->{node}'
-                    else:
-                        # Handling Node[Feature=Value]
-                        try:
-                            p = f'{node}[{var}="{treebank[m["sent_id"]][idx][var]}"]'
-                        except KeyError:
-                            continue
-                    lst.append(p)
-            # Handling option
-            if option:
-                # powerset
-                values = ["; ".join(v) for v in powerset(lst) if v]
-                for x in values:
-                    res.append(x)
-            else:
-                # largest combinations
-                if lst:
-                    res.append("; ".join(lst))
-        patterns = Counter(res)
-    # if is_key is False/None 
-    else:
-        if option:
-            patterns = ["; ".join(p) for p in powerset([x.strip() for x in P3.split(";")]) if p]
-        else:
-            patterns = [P3]
-    return patterns
-
-
-def rules_extraction(treebank_idx, treebank, P1, P2, P3, option):
+def iter_rules(treebank_idx, treebank, P1, P2, P3, option, queries = grew, min_support = 1, max_length = None, dominant = False, closed = False, chunk_size = 2000, trace = None):
+    """Tests the patterns by chunks and yields (tested, total, significant rows of the chunk) after each one,
+    a row being [pattern, significance, probability ratio, % of P1&P2, % of P1&P3(, class size)], the phases being timed in trace.
+    The patterns are tested while they are mined, total being the number of patterns found so far"""
+    trace = trace or NO_TRACE
+    patterns, counts = [], {}
+    if dominant:
+        trie, log10_pvalues, ratios = PatternTrie(), {}, {}
+
+    def test(chunk):
+        "Significant rows of the patterns of the chunk (indices in patterns)"
+        kN = np.array([counts[patterns[i]][:2] for i in chunk], dtype=np.int64).reshape(-1, 2)
+        # Patterns whose support can't reach ALPHA are not tested
+        keep = testable(kN[:, 1], n, M, ALPHA)
+        chunk, kN = np.asarray(chunk, dtype=np.int64)[keep], kN[keep]
+        trace.count("patterns tested", len(chunk))
+        # One vectorized Fisher test over the chunk
+        with trace.phase("fisher"):
+            stats = fisher_batch(kN[:, 0], n, kN[:, 1], M)
+        rows = []
+        with trace.phase("output"):
+            for j in np.flatnonzero(stats["pvalue"] < ALPHA):
+                i = chunk[j]
+                if dominant:
+                    # Only the patterns more significant than all their significant sub-patterns
+                    key = trie.key(patterns[i].split("; "))
+                    log10_pvalues[i], ratios[i] = stats["log10_pvalue"][j], stats["probability_ratio"][j]
+                    keep = dominates(i, key, trie, log10_pvalues, ratios)
+                    trie.add(key, i)
+                    if not keep:
+                        continue
+                rows.append([patterns[i], float(stats["significance"][j]), float(stats["probability_ratio"][j]),
+                             float(stats["percent_M1M2"][j]), float(stats["percent_M1M3"][j])] + list(counts[patterns[i]][2:]))
+        return rows
+
+    # Contingency counts of every pattern from the P1 matches, by steps of the mining
+    # (closed: only the largest pattern of each set of matches, with the number of patterns of the set)
+    mining = iter_contingency(treebank_idx, treebank, P1, P2, P3, option, queries=queries, min_support=min_support, max_length=max_length,
+                              alpha=ALPHA, closed=closed, trace=trace, batch_size=chunk_size)
+    tested = 0
+    try:
+        while True:
+            with trace.phase("contingency"):
+                step = next(mining, None)
+            if step is None:
+                break
+            M, n, batch = step
+            counts.update(batch)
+            patterns.extend(batch)
+            if dominant:
+                # The sub-patterns have to be tested first: only the progress of the mining
+                yield 0, len(patterns), []
+                continue
+            rows = test(range(tested, len(patterns))) if batch else []
+            tested = len(patterns)
+            yield tested, len(patterns), rows
+    finally:
+        # Stops the mining when the caller stops iterating (e.g. a cancelled extraction)
+        mining.close()
+
+    if dominant:
+        # Sub-patterns first: a pattern is kept or not as soon as it is tested
+        order = sorted(range(len(patterns)), key=lambda i: patterns[i].count("; "))
+        total = len(patterns)
+        for start in range(0, total, chunk_size):
+            yield min(start + chunk_size, total), total, test(order[start:start + chunk_size])
+
+
+def rules_frame(rows) -> pd.DataFrame:
+    "Rows of iter_rules from the most significant pattern, rounded"
+    columns = ["Pattern", "Significance", "Probability ratio", "% of P1&P2", "% of P1&P3"]
+    if rows and len(rows[0]) > len(columns):
+        columns.append("Class size")
+    # -log10(p) computed in log space, so p-values that underflow to 0.0 are still ranked
+    res = [[row[0]] + [round(x, 2) for x in row[1:5]] + row[5:] for row in sorted(rows, key=lambda row: -row[1])]
+    return pd.DataFrame(res, columns=columns)
+
+
+def rules_extraction(treebank_idx, treebank, P1, P2, P3, option, queries = grew, min_support = 1, max_length = None, dominant = False, closed = False):
 
     res = []
-
-    patterns = get_patterns2query(treebank_idx, treebank, P1, P3, option)
-    # Significance calculation
-    M = grew.corpus_count(pattern = format_pattern(P1), corpus_index = treebank_idx)
-    n = grew.corpus_count(pattern = format_pattern(P1, P2), corpus_index = treebank_idx)
-    for pat in patterns:
-        # this is for handle the two possibilities : if it's a dict it has key patterns, on the contrary it has only simple patterns
-        if isinstance(patterns, dict):
-            N = patterns[pat]
-        else:
-            N = grew.corpus_count(pattern = format_pattern(P1, pat), corpus_index = treebank_idx)
-
-        k = grew.corpus_count(pattern = format_pattern(P1, P2, pat), corpus_index = treebank_idx)
-        table = np.array([[k, n-k], [N-k, M - (n + N) + k]])
-        _, p_value = fisher_exact(table = table, alternative='greater')
-        if p_value < 0.01:
-            significance = format_significance(p_value)
-            percent_M1M2 = round((k/n)*100, 2)
-            percent_M1M3 = round((k/N)*100, 2)
-            probability_ratio = round((k/N)/((n-k)/(M-N)), 2)
-            res.append([pat, significance, probability_ratio, percent_M1M2, percent_M1M3])
-    
-    df = pd.DataFrame(res, columns=["Pattern", "Significance", "Probability ratio", "% of P1&P2", "% of P1&P3"])
-    return df
+    for _, _, rows in iter_rules(treebank_idx, treebank, P1, P2, P3, option, queries, min_support, max_length, dominant, closed):
+        res.extend(rows)
+    return rules_frame(res)
+
+
+class CorpusPool:
+
+    def __init__(self, max_mb : int = TREEBANK_CACHE_MB):
+        "Corpora loaded in grew and parsed, keyed by the hash of their content and shared by all the sessions, max_mb bounding the parsed treebanks"
+        self.max_bytes = max_mb * 2**20
+        self.corpora = OrderedDict()
+        # Corpora being loaded: key -> Future of (index, treebank), the sessions uploading the same file wait on it
+        self.loading = {}
+        # Only held for the bookkeeping, never while a corpus is loaded
+        self.lock = threading.Lock()
+
+    def get(self, content : bytes, filename : str) -> Tuple[int, Treebank]:
+        "Index and treebank of the uploaded content, loaded on the first upload only"
+        key = hashlib.sha1(content).hexdigest()
+        with self.lock:
+            if key in self.corpora:
+                self.corpora.move_to_end(key)
+                return self.corpora[key][:2]
+            future = self.loading.get(key)
+            loader = future is None
+            if loader:
+                future = self.loading[key] = Future()
+        if not loader:
+            return future.result()
+
+        try:
+            treebank_idx, treebank = load_corpus(content, filename, key)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.corpora[key] = (treebank_idx, treebank, treebank.nbytes)
+            self.evict()
+            del self.loading[key]
+        future.set_result((treebank_idx, treebank))
+        return treebank_idx, treebank
+
+    def nbytes(self) -> int:
+        return sum(size for _, _, size in self.corpora.values())
+
+    def evict(self):
+        # Least recently used treebanks first, the last one loaded is always kept
+        # (only the treebank is freed: the grew server keeps the index until it is restarted)
+        while len(self.corpora) > 1 and self.nbytes() > self.max_bytes:
+            self.corpora.popitem(last=False)
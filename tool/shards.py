@@ -0,0 +1,96 @@
+import os, pickle
+from collections import defaultdict
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from contingency import build_contingency, get_items, get_predictors, outcome_weights
+from occurrence_index import OccurrenceIndex
+from treebank_cache import load_treebank
+
+# ---------- Sharded extraction (map-reduce of the contingency counts) ----------
+#
+# A treebank too large for one grew server is split into sentence-aligned
+# shards, each searched by a worker on its own. M, n and the (k, N) of a
+# pattern are sums over the matches of P1, and no match spans two sentences,
+# so the counts of the shards add up to the counts of the whole treebank.
+#
+# The largest combinations and the clause patterns are counted exactly in one
+# pass. For all the combinations (-a) with a minimum support s, the shards are
+# mined SON-style: a pattern of support >= s overall has a support of at least
+# s * M_shard / M in one shard at least, so the patterns frequent at that
+# scaled threshold in some shard are the only candidates, and each shard then
+# counts the candidates it did not find itself. The P1 match table of a shard
+# (predictor items and P1&P2 weights) is pickled by the first pass, the later
+# passes don't query grew again.
+
+def split_conllu(files : Iterable[str], sentences : int, directory : str) -> List[str]:
+    "Writes the sentences of the files in shards of at most this number of sentences, returns their paths"
+    shards, out, count = [], None, 0
+    for path in files:
+        last = ""
+        with open(path, encoding="utf-8") as f:
+            # A file may not end with a blank line
+            for line in chain(f, ["\n"]):
+                blank = not line.strip()
+                if blank and not last.strip():
+                    continue
+                if out is None:
+                    shards.append(os.path.join(directory, f"shard-{len(shards):05d}.conllu"))
+                    out = open(shards[-1], "w", encoding="utf-8")
+                out.write(line)
+                last = line
+                if blank:
+                    count += 1
+                    if count == sentences:
+                        out.close()
+                        out, count = None, 0
+    if out is not None:
+        out.close()
+    return shards
+
+def table_path(shard : str) -> str:
+    return shard + ".matches"
+
+def count_shard(shard : str, P1 : str, P2 : str, P3 : str, option : bool) -> Tuple[int, int, Optional[Dict[str, Tuple[int, int]]]]:
+    """First pass on a shard (in a worker with a grew server): M, n and the exact counts of its patterns,
+    or M, n and None for all the combinations of the predictors, whose match table is kept for the next passes"""
+    import grew
+    treebank_idx = grew.corpus(shard)
+    treebank = load_treebank(shard, cache_dir=None)
+    predictors, any_key = get_predictors(P1, P3)
+    if not (option and any_key):
+        # Exact counts: every pattern is kept, the support threshold only applies to the sums
+        return build_contingency(treebank_idx, treebank, P1, P2, P3, option, quote=False)
+
+    matchs, _, _, weights, M, n = outcome_weights(treebank_idx, P1, P2)
+    rows = [get_items(m, treebank, predictors, quote=False) for m in matchs]
+    with open(table_path(shard), "wb") as f:
+        pickle.dump((rows, weights), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return M, n, None
+
+def load_index(shard : str) -> OccurrenceIndex:
+    with open(table_path(shard), "rb") as f:
+        rows, weights = pickle.load(f)
+    return OccurrenceIndex(rows, weights)
+
+def local_candidates(shard : str, min_support : int, max_length : Optional[int]) -> Dict[Tuple[str, ...], List[int]]:
+    "Second pass: [k, N] of the combinations frequent in the shard at its scaled threshold"
+    return load_index(shard).eclat(min_support, max_length)
+
+def count_candidates(shard : str, candidates : List[Tuple[str, ...]]) -> Dict[Tuple[str, ...], List[int]]:
+    "Third pass: [k, N] in the shard of the candidates found in the other shards only"
+    index = load_index(shard)
+    return {items : index.support(items) for items in candidates if all(item in index.items for item in items)}
+
+def scaled_support(min_support : int, M_shard : int, M : int) -> int:
+    "ceil(min_support * M_shard / M), at least 1"
+    return max(1, -(-min_support * M_shard // M)) if M else 1
+
+def merge_counts(counts : Iterable[Dict]) -> Dict:
+    "Sum of the (k, N) of each pattern over the shards"
+    res = defaultdict(lambda: [0, 0])
+    for shard_counts in counts:
+        for pat, (k, N) in shard_counts.items():
+            res[pat][0] += k
+            res[pat][1] += N
+    return dict(res)
@@ -0,0 +1,104 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from scipy.special import logsumexp
+from scipy.stats import hypergeom
+
+# ---------- Batch one-sided Fisher exact test ----------
+#
+# For each pattern, the 2x2 table of the extraction scripts
+#     [[k, n-k], [N-k, M - (n + N) + k]]
+# is tested with alternative='greater'. Everything is computed on arrays in a
+# single call instead of one scipy.stats.fisher_exact per pattern; the
+# p-values and odds ratios are the ones fisher_exact returns (same formula).
+# The significance -log10(p) is computed in log space for the p-values that
+# underflow, so that the most extreme patterns are still ranked.
+#
+# Given M and n, the smallest p-value a pattern of support N can reach is the
+# one of k = min(n, N) (Tarone's bound). It only depends on N and, for N <= n,
+# it decreases with N: below min_testable_support no pattern can be
+# significant, and neither can its supersets (their support is lower). Such
+# patterns are neither counted nor tested.
+
+# Significance threshold of the extraction scripts
+ALPHA = 0.01
+
+# Below this p-value, the tail is summed in log space (double precision underflows around 1e-308)
+LOG_SPACE_BELOW = 1e-250
+
+
+def log_tail(k : int, n : int, N : int, M : int) -> float:
+    "Natural log of P(X >= k), X ~ hypergeom(M, n, N), summing the pmf in log space"
+    x = np.arange(k, min(n, N) + 1)
+    return float(logsumexp(hypergeom.logpmf(x, M, n, N)))
+
+
+def log10_pvalues(pvalue : np.ndarray, k, n, N, M) -> np.ndarray:
+    "log10 of the p-values, the ones too small for float precision being recomputed in log space"
+    # Flattened so that scalars (0-d arrays) and tables of any shape can be indexed, reshaped at the end
+    pvalue, k, n, N, M = np.broadcast_arrays(*(np.asarray(x) for x in (pvalue, k, n, N, M)))
+    shape = pvalue.shape
+    pvalue, k, n, N, M = (x.ravel() for x in (pvalue, k, n, N, M))
+    with np.errstate(divide="ignore"):
+        log10_p = np.log10(pvalue)
+    for i in np.flatnonzero(pvalue < LOG_SPACE_BELOW):
+        log10_p[i] = log_tail(k[i], n[i], N[i], M[i]) / np.log(10)
+    return log10_p.reshape(shape)
+
+
+def log_min_pvalue(N, n, M) -> np.ndarray:
+    "Natural log of the smallest p-value attainable by patterns of support N"
+    N, n, M = np.broadcast_arrays(*(np.asarray(x, dtype=np.int64) for x in (N, n, M)))
+    with np.errstate(divide="ignore"):
+        log_p = hypergeom.logpmf(np.minimum(n, N), M, n, N)
+    # Empty tables are tested as p = 1.0
+    empty = (n == 0) | (M - n == 0) | (N == 0) | (M - N == 0)
+    return np.where(empty, 0.0, np.minimum(log_p, 0.0))
+
+
+def testable(N, n, M, alpha : float = ALPHA) -> np.ndarray:
+    "Patterns of support N that can reach a p-value below alpha"
+    return log_min_pvalue(N, n, M) < np.log(alpha)
+
+
+def min_testable_support(n : int, M : int, alpha : float = ALPHA) -> int:
+    "Smallest support N for which a pattern can be significant, M + 1 if none can"
+    # The bound decreases up to N = n and increases after: if N = n isn't testable, nothing is
+    if n <= 0 or not testable(n, n, M, alpha):
+        return M + 1
+    N = np.arange(1, n + 1)
+    return int(N[np.argmax(testable(N, n, M, alpha))])
+
+
+def fisher_batch(k, n, N, M) -> Dict[str, np.ndarray]:
+    "p-values, odds ratios, probability ratios and percentages for arrays of (k, n, N, M)"
+    k, n, N, M = np.broadcast_arrays(*(np.asarray(x, dtype=np.int64) for x in (k, n, N, M)))
+    a, b, c, d = k, n - k, N - k, M - (n + N) + k
+
+    # P(X >= k) for X ~ hypergeom(M, n, N), written as fisher_exact does (cdf of the second column)
+    pvalue = np.minimum(hypergeom.cdf(b, M, n, b + d), 1.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        oddsr = np.where((b > 0) & (c > 0), (a * d) / (b * c), np.inf)
+        probability_ratio = (k / N) / ((n - k) / (M - N))
+        percent_M1M2 = (k / n) * 100
+        percent_M1M3 = (k / N) * 100
+
+    # A row or a column of the table is empty: fisher_exact returns (nan, 1.0)
+    empty = (n == 0) | (M - n == 0) | (N == 0) | (M - N == 0)
+    pvalue = np.where(empty, 1.0, pvalue)
+    oddsr = np.where(empty, np.nan, oddsr)
+
+    # Significance = -log10(p), finite even when p underflows to 0.0
+    log10_pvalue = log10_pvalues(pvalue, k, n, N, M)
+
+    return {"pvalue" : pvalue, "log10_pvalue" : log10_pvalue, "significance" : 0.0 - log10_pvalue, "oddsr" : oddsr, "probability_ratio" : probability_ratio, "percent_M1M2" : percent_M1M2, "percent_M1M3" : percent_M1M3}
+
+
+def fisher_patterns(counts : Dict, n : int, M : int, alpha : Optional[float] = None) -> Tuple[List, Dict[str, np.ndarray]]:
+    "fisher_batch over {pattern : (k, N, ...)}, returns the patterns in the order of the arrays (only the testable ones with alpha)"
+    patterns = list(counts)
+    kN = np.array([counts[pat][:2] for pat in patterns], dtype=np.int64).reshape(-1, 2)
+    if alpha is not None:
+        keep = testable(kN[:, 1], n, M, alpha)
+        patterns, kN = [pat for pat, t in zip(patterns, keep) if t], kN[keep]
+    return patterns, fisher_batch(kN[:, 0], n, kN[:, 1], M)
@@ -0,0 +1,126 @@
+import hashlib, json, os, shutil
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+
+from conllu_reader import FIELDS, ROOT
+from treebank_store import Treebank
+
+# ---------- On-disk cache of parsed treebanks ----------
+#
+# The first load of a .conllu file writes the columns of its Treebank as .npy
+# files (plus a meta.json with the vocabularies and sent_ids) in a directory
+# named after the content hash of the file. Later loads map the .npy files
+# with np.load(mmap_mode="r"), so nothing is parsed.
+# To avoid hashing the file on every load, index.json remembers the hash of
+# each path together with its size and mtime: the file is only hashed again
+# when one of them changed.
+#
+# Only the Python side is cached: the grew index lives in the grew server
+# process and is rebuilt by grew.corpus(...).
+
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = Path(os.environ.get("TREEBANK_CACHE_DIR", Path.home() / ".cache" / "memoire-m2tal" / "treebanks"))
+
+
+def file_hash(path : Union[str, Path]) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_hash(path : Union[str, Path], cache_dir : Path = DEFAULT_CACHE_DIR) -> str:
+    "Hash of the file, reused from index.json while its size and mtime are unchanged"
+    path = Path(path).resolve()
+    stat = path.stat()
+    index_path = cache_dir / "index.json"
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    entry = index.get(str(path))
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+        return entry["hash"]
+
+    digest = file_hash(path)
+    index[str(path)] = {"size" : stat.st_size, "mtime" : stat.st_mtime_ns, "hash" : digest}
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp = index_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, index_path)
+    return digest
+
+
+def cache_key(digest : str, fields : Tuple[str, ...], root : Dict[str, str]) -> str:
+    # The fields and the root node change the columns, so they are part of the key
+    options = json.dumps([CACHE_VERSION, list(fields), root], sort_keys=True)
+    return f"{digest}-{hashlib.sha1(options.encode('utf-8')).hexdigest()[:12]}"
+
+
+def save_treebank(treebank : Treebank, directory : Path):
+    "Write treebank in directory (atomically: a concurrent reader sees either nothing or the full image)"
+    tmp = directory.with_name(f"{directory.name}.{os.getpid()}.tmp")
+    tmp.mkdir(parents=True, exist_ok=True)
+    names = list(treebank.columns)
+    np.save(tmp / "offsets.npy", treebank.offsets)
+    np.save(tmp / "heads.npy", treebank.heads)
+    for i, var in enumerate(names):
+        np.save(tmp / f"col{i}.npy", treebank.columns[var])
+    meta = {
+        "version" : CACHE_VERSION,
+        "fields" : list(treebank.fields),
+        "columns" : names,
+        "vocabs" : [treebank.vocabs[var] for var in names],
+        "sent_ids" : treebank.sent_ids,
+        "irregular" : {str(i) : ids for i, ids in treebank.irregular.items()},
+        "fingerprint" : treebank.fingerprint,
+    }
+    with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.replace(tmp, directory)
+    except OSError:
+        # Another process wrote the same image in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def open_treebank(directory : Path) -> Treebank:
+    "Map a treebank written by save_treebank"
+    with open(directory / "meta.json", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["version"] != CACHE_VERSION:
+        raise ValueError(f"Unsupported cache version in {directory}")
+    names = meta["columns"]
+    columns = {var : np.load(directory / f"col{i}.npy", mmap_mode="r") for i, var in enumerate(names)}
+    vocabs = dict(zip(names, meta["vocabs"]))
+    irregular = {int(i) : ids for i, ids in meta["irregular"].items()}
+    return Treebank(meta["sent_ids"], np.load(directory / "offsets.npy", mmap_mode="r"), np.load(directory / "heads.npy", mmap_mode="r"), columns, vocabs, meta["fields"], irregular, meta["fingerprint"])
+
+
+def load_treebank(path : Union[str, Path], fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None, cache_dir : Optional[Union[str, Path]] = DEFAULT_CACHE_DIR) -> Treebank:
+    "Treebank.from_conllu(path) going through the cache, cache_dir=None disables the cache"
+    root = ROOT if root is None else root
+    if cache_dir is None:
+        treebank = Treebank.from_conllu(path, fields, root)
+        treebank.fingerprint = file_hash(path)
+        return treebank
+
+    cache_dir = Path(cache_dir)
+    digest = content_hash(path, cache_dir)
+    directory = cache_dir / cache_key(digest, fields, root)
+    if (directory / "meta.json").exists():
+        try:
+            return open_treebank(directory)
+        except (OSError, ValueError):
+            # Broken or outdated image: parse again and replace it
+            shutil.rmtree(directory, ignore_errors=True)
+
+    treebank = Treebank.from_conllu(path, fields, root)
+    treebank.fingerprint = digest
+    save_treebank(treebank, directory)
+    return treebank
@@ -0,0 +1,305 @@
+from array import array
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+import numpy as np
+
+from conllu_reader import COLUMNS, FIELDS, ROOT, iter_sentences, parse_feats
+
+# ---------- Columnar treebank ----------
+#
+# Instead of one dict per token, every token attribute (form, lemma, upos,
+# deprel and each feature) is an integer column indexed by the token row, the
+# strings being interned once in a vocabulary per attribute. -1 means that the
+# token has no value for this attribute (e.g. a missing feature).
+# Sentence i owns the rows offsets[i]:offsets[i+1], row 0 of a sentence being
+# the root node '0', so that token 'j' is at row offsets[i] + j.
+#
+# The Treebank, Sentence and Token objects are read-only mappings, so that
+# treebank[sent_id][token_id][var] behaves like the dicts of conllu2dict.
+
+class Token(Mapping):
+
+    __slots__ = ("_treebank", "_row")
+
+    def __init__(self, treebank : "Treebank", row : int):
+        self._treebank = treebank
+        self._row = row
+
+    def __getitem__(self, var : str) -> str:
+        return self._treebank.row_value(self._row, var)
+
+    def __iter__(self) -> Iterator[str]:
+        columns = self._treebank.columns
+        for var in self._treebank.attributes:
+            if columns[var][self._row] >= 0:
+                yield var
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class Sentence(Mapping):
+
+    __slots__ = ("_treebank", "_index")
+
+    def __init__(self, treebank : "Treebank", index : int):
+        self._treebank = treebank
+        self._index = index
+
+    def __getitem__(self, token_id : str) -> Token:
+        return Token(self._treebank, self._treebank.row(self._index, token_id))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._treebank.token_ids(self._index))
+
+    def __len__(self) -> int:
+        return self._treebank.sentence_length(self._index)
+
+    def __repr__(self) -> str:
+        return repr({token_id : dict(token) for token_id, token in self.items()})
+
+
+class Treebank(Mapping):
+
+    def __init__(self, sent_ids : List[str], offsets : np.ndarray, heads : np.ndarray, columns : Dict[str, np.ndarray], vocabs : Dict[str, List[str]], fields : Tuple[str, ...] = FIELDS, irregular : Optional[Dict[int, Dict[str, int]]] = None, fingerprint : Optional[str] = None):
+        self.sent_ids = sent_ids
+        self.offsets = offsets
+        self.heads = heads
+        self.columns = columns
+        self.vocabs = vocabs
+        self.fields = tuple(fields)
+        # Sentences whose token ids are not 0..n (e.g. empty nodes): token_id -> local row
+        self.irregular = irregular or {}
+        # Iteration order of the token attributes: fields first, then features as in CoNLL-U
+        features = sorted((var for var in columns if var not in self.fields), key=str.lower)
+        self.attributes = tuple(var for var in self.fields if var in columns) + tuple(features)
+        self.sent_index = {sent_id : i for i, sent_id in enumerate(sent_ids)}
+        # Content hash of the source file(s), set by treebank_cache
+        self.fingerprint = fingerprint
+        self._codes = {}
+        # Plain views for the hot loops: one Python int per sentence, columns read without numpy scalars
+        self._starts = np.asarray(offsets).tolist()
+        self._views = {}
+
+    def __getstate__(self):
+        # The memoryviews can't be pickled (treebanks are returned by the loading processes)
+        state = self.__dict__.copy()
+        state["_views"] = {}
+        return state
+
+    # Mapping interface: sent_id -> Sentence
+
+    def __getitem__(self, sent_id : str) -> Sentence:
+        return Sentence(self, self.sent_index[sent_id])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.sent_ids)
+
+    def __len__(self) -> int:
+        return len(self.sent_ids)
+
+    def __contains__(self, sent_id) -> bool:
+        return sent_id in self.sent_index
+
+    # Row access
+
+    def sentence_length(self, index : int) -> int:
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def token_ids(self, index : int) -> List[str]:
+        ids = self.irregular.get(index)
+        if ids is not None:
+            return list(ids)
+        return [str(i) for i in range(self.sentence_length(index))]
+
+    def row(self, index : int, token_id : str) -> int:
+        ids = self.irregular.get(index)
+        if ids is not None:
+            local = ids[token_id]
+        else:
+            try:
+                local = int(token_id)
+            except ValueError:
+                raise KeyError(token_id)
+            if not 0 <= local < self.sentence_length(index) or str(local) != token_id:
+                raise KeyError(token_id)
+        return int(self.offsets[index]) + local
+
+    def row_value(self, row : int, var : str) -> str:
+        code = self.columns[var][row]
+        if code < 0:
+            raise KeyError(var)
+        return self.vocabs[var][code]
+
+    def token_row(self, sent_id : str, token_id : str) -> int:
+        "Row of a token, the fast path of row() for the predictor loops (read each attribute with get)"
+        index = self.sent_index[sent_id]
+        if index in self.irregular:
+            return self.row(index, token_id)
+        local = int(token_id)
+        if not 0 <= local < self._starts[index + 1] - self._starts[index]:
+            raise KeyError(token_id)
+        return self._starts[index] + local
+
+    def get(self, row : int, var : str, default : Optional[str] = None) -> Optional[str]:
+        "Value of var at a row, default if the token doesn't have it"
+        view = self._views.get(var)
+        if view is None:
+            if var not in self.columns:
+                return default
+            view = self._views[var] = memoryview(np.ascontiguousarray(self.columns[var]))
+        code = view[row]
+        return default if code < 0 else self.vocabs[var][code]
+
+    def value(self, sent_id : str, token_id : str, var : str) -> str:
+        "Same as treebank[sent_id][token_id][var] without building the intermediate views"
+        return self.row_value(self.row(self.sent_index[sent_id], token_id), var)
+
+    def code(self, var : str, value : str) -> int:
+        "Integer id of value in the vocabulary of var, -1 if it never occurs"
+        if var not in self._codes:
+            self._codes[var] = {v : i for i, v in enumerate(self.vocabs[var])}
+        return self._codes[var].get(value, -1)
+
+    @property
+    def n_tokens(self) -> int:
+        return int(self.offsets[-1])
+
+    @property
+    def nbytes(self) -> int:
+        "Approximate size of the arrays (vocabularies excluded)"
+        return self.offsets.nbytes + self.heads.nbytes + sum(col.nbytes for col in self.columns.values())
+
+    # Construction
+
+    @classmethod
+    def from_file(cls, f : TextIO, fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None) -> "Treebank":
+        builder = TreebankBuilder(fields, root)
+        for sent_id, rows in iter_sentences(f):
+            builder.add(sent_id, rows)
+        return builder.build()
+
+    @classmethod
+    def from_conllu(cls, path : str, fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None) -> "Treebank":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_file(f, fields, root)
+
+
+class TreebankBuilder:
+    "Accumulates sentences from conllu_reader.iter_sentences and builds a Treebank"
+
+    def __init__(self, fields : Tuple[str, ...] = FIELDS, root : Optional[Dict[str, str]] = None):
+        self.fields = tuple(fields)
+        self.root = ROOT if root is None else root
+        self.sent_ids = []
+        self.offsets = array('q', [0])
+        self.heads = array('i')
+        self.irregular = {}
+        # Sparse columns: var -> (rows, codes), made dense in build()
+        self.rows = {}
+        self.codes = {}
+        self.vocabs = {}
+        self.lookup = {}
+
+    def _set(self, var : str, row : int, value : str):
+        lookup = self.lookup.get(var)
+        if lookup is None:
+            lookup = self.lookup[var] = {}
+            self.vocabs[var] = []
+            self.rows[var] = array('q')
+            self.codes[var] = array('i')
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(self.vocabs[var])
+            self.vocabs[var].append(value)
+        self.rows[var].append(row)
+        self.codes[var].append(code)
+
+    def add(self, sent_id : str, rows : List[List[str]]):
+        start = self.offsets[-1]
+        ids = {'0' : 0}
+        regular = True
+        for local, cols in enumerate(rows, 1):
+            ids[cols[0]] = local
+            regular = regular and cols[0] == str(local)
+
+        for var, value in self.root.items():
+            self._set(var, start, value)
+        self.heads.append(-1)
+        for local, cols in enumerate(rows, 1):
+            row = start + local
+            for field in self.fields:
+                self._set(field, row, cols[COLUMNS[field]])
+            for var, value in parse_feats(cols[COLUMNS["feats"]]).items():
+                self._set(var, row, value)
+            self.heads.append(ids.get(cols[COLUMNS["head"]], -1))
+
+        if not regular:
+            self.irregular[len(self.sent_ids)] = ids
+        self.sent_ids.append(sent_id)
+        self.offsets.append(start + len(rows) + 1)
+
+    def build(self) -> Treebank:
+        n_tokens = self.offsets[-1]
+        columns = {}
+        for var, vocab in self.vocabs.items():
+            dtype = np.int16 if len(vocab) < np.iinfo(np.int16).max else np.int32
+            col = np.full(n_tokens, -1, dtype=dtype)
+            col[np.frombuffer(self.rows[var], dtype=np.int64)] = np.frombuffer(self.codes[var], dtype=np.int32)
+            columns[var] = col
+        offsets = np.frombuffer(self.offsets, dtype=np.int64).copy()
+        heads = np.frombuffer(self.heads, dtype=np.int32).copy()
+        return Treebank(self.sent_ids, offsets, heads, columns, self.vocabs, self.fields, self.irregular)
+
+
+def concat_treebanks(treebanks : List[Treebank]) -> Treebank:
+    "Merge several treebanks (e.g. the dev/test/train files of a corpus) into one, sent_ids must be distinct"
+    fields = treebanks[0].fields
+    if any(tb.fields != fields for tb in treebanks):
+        raise ValueError("Cannot merge treebanks loaded with different fields")
+
+    sent_ids, seen = [], set()
+    for tb in treebanks:
+        duplicates = seen.intersection(tb.sent_ids)
+        if duplicates:
+            raise ValueError(f"sent_id {sorted(duplicates)[0]} occurs in several files")
+        seen.update(tb.sent_ids)
+        sent_ids.extend(tb.sent_ids)
+
+    # Re-intern every vocabulary and translate the codes of each treebank
+    vocabs, lookups = {}, {}
+    for tb in treebanks:
+        for var, vocab in tb.vocabs.items():
+            lookup = lookups.setdefault(var, {})
+            merged = vocabs.setdefault(var, [])
+            for value in vocab:
+                if value not in lookup:
+                    lookup[value] = len(merged)
+                    merged.append(value)
+
+    columns = {}
+    for var, vocab in vocabs.items():
+        dtype = np.int16 if len(vocab) < np.iinfo(np.int16).max else np.int32
+        parts = []
+        for tb in treebanks:
+            if var in tb.columns:
+                remap = np.array([lookups[var][value] for value in tb.vocabs[var]] + [-1], dtype=dtype)
+                # code -1 picks the last element of remap, i.e. -1
+                parts.append(remap[tb.columns[var]])
+            else:
+                parts.append(np.full(tb.n_tokens, -1, dtype=dtype))
+        columns[var] = np.concatenate(parts)
+
+    offsets, irregular = [np.zeros(1, dtype=np.int64)], {}
+    shift, n_sents = 0, 0
+    for tb in treebanks:
+        offsets.append(np.asarray(tb.offsets[1:], dtype=np.int64) + shift)
+        irregular.update({index + n_sents : ids for index, ids in tb.irregular.items()})
+        shift += tb.n_tokens
+        n_sents += len(tb)
+    heads = np.concatenate([np.asarray(tb.heads) for tb in treebanks])
+
+    return Treebank(sent_ids, np.concatenate(offsets), heads, columns, vocabs, fields, irregular)